@@ -0,0 +1,189 @@
+"""
+Multiplexed sub-requests behind a single /batch call.
+
+Sub-requests are dispatched in-process straight to the app's router, so they
+skip the HTTP round trip and the per-request middleware, share the caches of
+the proxied routes and run concurrently. The caller is authenticated once;
+the outcome is handed to every sub-request through the ASGI scope state. Results are streamed back as NDJSON in completion order.
+"""
+import asyncio
+import logging
+import time
+from typing import Any, AsyncIterator, Optional
+
+from pydantic import BaseModel, Field
+from pydantic_settings import BaseSettings, SettingsConfigDict
+from starlette.exceptions import HTTPException
+from starlette.types import ASGIApp, Message, Scope
+
+from payload import JSON_MEDIA_TYPE, dumps
+
+logger = logging.getLogger("api_monitor")
+
+# Headers a sub-request may not set: the batch decides encoding and identity
+RESERVED_HEADERS = {"accept-encoding", "authorization", "content-length", "host"}
+
+
+class BatchSettings(BaseSettings):
+    """Batch limits, overridable with BATCH_* env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="BATCH_")
+
+    max_requests: int = 20
+    # Sub-requests of one batch in flight at a time
+    max_concurrency: int = 8
+
+
+class SubRequest(BaseModel):
+    # Echoed back to match results to requests; defaults to the position
+    id: Optional[str] = None
+    path: str = Field(pattern=r"^/")
+    headers: dict[str, str] = {}
+
+
+class BatchRequest(BaseModel):
+    requests: list[SubRequest] = Field(min_length=1)
+
+
+class SubResponse:
+    __slots__ = ("status", "headers", "body")
+
+    def __init__(self, status: int, headers: list[tuple[bytes, bytes]], body: bytes):
+        self.status = status
+        self.headers = headers
+        self.body = body
+
+    @property
+    def media_type(self) -> str:
+        for name, value in self.headers:
+            if name.lower() == b"content-type":
+                return value.decode("latin-1").split(";")[0].strip()
+        return ""
+
+
+class BatchStats:
+    def __init__(self):
+        self.batches = 0
+        self.subrequests = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {"batches": self.batches, "subrequests": self.subrequests, "errors": self.errors}
+
+
+batch_stats = BatchStats()
+
+
+def subrequest_scope(parent: Scope, sub: SubRequest, authorization: Optional[bytes], state: dict) -> Scope:
+    path, _, query = sub.path.partition("?")
+    headers = [
+        (name.lower().encode("latin-1"), value.encode("latin-1"))
+        for name, value in sub.headers.items()
+        if name.lower() not in RESERVED_HEADERS
+    ]
+    if authorization is not None:
+        headers.append((b"authorization", authorization))
+    scope = {
+        key: value
+        for key, value in parent.items()
+        # Routing results of the /batch request itself
+        if key not in ("route", "endpoint", "path_params")
+    }
+    scope.update(
+        method="GET",
+        path=path,
+        raw_path=path.encode("utf-8"),
+        query_string=query.encode("latin-1"),
+        headers=headers,
+        state=dict(state),
+    )
+    return scope
+
+
+async def dispatch(router: ASGIApp, scope: Scope) -> SubResponse:
+    """Runs one GET through `router` and collects the whole response."""
+    status = 500
+    response_headers: list = []
+    chunks: list[bytes] = []
+    finished = asyncio.Event()
+    request_sent = False
+
+    async def receive() -> Message:
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Streaming responses listen for a disconnect until they are done
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message: Message):
+        nonlocal status, response_headers
+        if message["type"] == "http.response.start":
+            status = message["status"]
+            response_headers = message.get("headers", [])
+        elif message["type"] == "http.response.body":
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                finished.set()
+
+    try:
+        await router(scope, receive, send)
+    except HTTPException as e:
+        # Raised by the router itself (no such path or method), outside any route
+        return SubResponse(e.status_code, [(b"content-type", JSON_MEDIA_TYPE.encode())], dumps({"detail": e.detail}))
+    finally:
+        finished.set()
+    return SubResponse(status, response_headers, b"".join(chunks))
+
+
+def encode_result(request_id: Any, response: SubResponse, duration: float) -> bytes:
+    """One NDJSON line; JSON bodies are embedded as-is rather than re-encoded."""
+    body = response.body
+    if not body:
+        encoded_body = b"null"
+    elif response.media_type == JSON_MEDIA_TYPE:
+        encoded_body = body
+    else:
+        encoded_body = dumps(body.decode("utf-8", errors="replace"))
+    head = dumps({"id": request_id, "status": response.status, "duration_ms": round(duration * 1000, 3)})
+    return head[:-1] + b',"body":' + encoded_body + b"}\n"
+
+
+async def run_batch(
+    router: ASGIApp,
+    parent: Scope,
+    batch: BatchRequest,
+    authorization: Optional[bytes],
+    state: dict,
+    max_concurrency: int,
+) -> AsyncIterator[bytes]:
+    """Resolves every sub-request concurrently, yielding NDJSON lines as they finish."""
+    slots = asyncio.Semaphore(max_concurrency)
+    batch_stats.batches += 1
+
+    async def resolve(position: int, sub: SubRequest) -> bytes:
+        request_id = sub.id if sub.id is not None else position
+        async with slots:
+            started = time.perf_counter()
+            try:
+                response = await dispatch(router, subrequest_scope(parent, sub, authorization, state))
+            except Exception:
+                # Logged in full here, but like any other 500 the client only learns that it failed
+                logger.exception(f"Batch sub-request {sub.path} failed")
+                detail = dumps({"detail": "Internal Server Error"})
+                response = SubResponse(500, [(b"content-type", JSON_MEDIA_TYPE.encode())], detail)
+            duration = time.perf_counter() - started
+        batch_stats.subrequests += 1
+        if response.status >= 400:
+            batch_stats.errors += 1
+        return encode_result(request_id, response, duration)
+
+    tasks = [asyncio.create_task(resolve(position, sub)) for position, sub in enumerate(batch.requests)]
+    try:
+        for next_done in asyncio.as_completed(tasks):
+            yield await next_done
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
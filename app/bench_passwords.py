@@ -0,0 +1,58 @@
+"""
+Login throughput of the password pool as the number of workers grows.
+
+Runs a burst of concurrent bcrypt verifications (what /token does per login)
+through each engine at each worker count and prints logins per second.
+
+    python bench_passwords.py --logins 64 --rounds 12 --workers 1 2 4 8
+"""
+import argparse
+import asyncio
+import os
+import time
+
+from passlib.context import CryptContext
+
+from passwords import PasswordPool
+
+
+async def measure(context: CryptContext, engine: str, workers: int, logins: int, batch_size: int) -> float:
+    pool = PasswordPool(context, engine=engine, workers=workers, max_queue=logins, batch_size=batch_size)
+    try:
+        await pool.start()
+        hashed = await pool.hash("correct horse battery staple")
+        started = time.perf_counter()
+        results = await asyncio.gather(*(pool.verify("correct horse battery staple", hashed) for _ in range(logins)))
+        elapsed = time.perf_counter() - started
+        assert all(results)
+        return logins / elapsed
+    finally:
+        pool.close()
+
+
+async def main():
+    cpus = os.cpu_count() or 1
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--logins", type=int, default=64, help="concurrent logins per measurement")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost")
+    parser.add_argument("--batch-size", type=int, default=8)
+    parser.add_argument("--engines", nargs="+", default=["thread", "process"], choices=["thread", "process"])
+    parser.add_argument(
+        "--workers", nargs="+", type=int,
+        default=sorted({1, *(n for n in (2, 4, 8, 16, 32) if n < cpus), cpus}),
+    )
+    args = parser.parse_args()
+
+    context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=args.rounds)
+    print(f"bcrypt cost {args.rounds}, {args.logins} concurrent logins, {cpus} CPUs")
+    print(f"{'engine':<8} {'workers':>7} {'logins/s':>10} {'speedup':>8}")
+    for engine in args.engines:
+        baseline = None
+        for workers in args.workers:
+            rate = await measure(context, engine, workers, args.logins, args.batch_size)
+            baseline = baseline or rate
+            print(f"{engine:<8} {workers:>7} {rate:>10.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,185 @@
+"""
+In-process TTL cache for proxied upstream responses.
+
+Entries are fresh for their TTL. After that they may still be served for a
+stale-while-revalidate window while a background task refreshes them, and
+for a stale-if-error window when the upstream cannot be reached. Memory is
+bounded by entry count and total size, evicting least recently used entries.
+"""
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Optional
+
+import httpx
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+from upstream import SingleFlight
+
+# A loader fetches a fresh value and returns it together with its size in bytes,
+# optionally followed by a TTL overriding the caller's (for values that are
+# already partly aged, e.g. read back from a shared tier)
+Loader = Callable[[], Awaitable[tuple]]
+
+
+class CacheSettings(BaseSettings):
+    """Cache defaults and bounds, overridable with CACHE_* env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="CACHE_")
+
+    stale_while_revalidate: float = 60.0
+    stale_if_error: float = 3600.0
+    max_entries: int = 128
+    max_bytes: int = 64 * 1024 * 1024
+    # Persistent tier shared by workers and restarts (see diskcache.py); off when unset
+    disk_dir: Optional[str] = None
+    # Slots in the cross-worker index of the disk tier, one per cached route
+    shared_slots: int = 256
+    # Re-encode upstream JSON compactly once per fetch (needs orjson)
+    normalize_json: bool = True
+    # Precompressed gzip (and brotli, when installed) variants of cached bodies
+    compress: bool = True
+    compress_min_bytes: int = 1024
+    gzip_level: int = 6
+    brotli_quality: int = 9
+
+
+class CacheEntry:
+    __slots__ = ("value", "size", "stored_at", "expires_at")
+
+    def __init__(self, value: Any, size: int, stored_at: float, expires_at: float):
+        self.value = value
+        self.size = size
+        self.stored_at = stored_at
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    def __init__(self, max_entries: int, max_bytes: int, clock: Callable[[], float] = time.monotonic):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.clock = clock
+        self._entries: OrderedDict[str, CacheEntry] = OrderedDict()
+        self._refreshing: dict[str, asyncio.Task] = {}
+        # Concurrent loads of one key run the loader (fetch, normalize,
+        # compress) once and all get the same entry
+        self._loads = SingleFlight()
+        self.total_bytes = 0
+        self.hits = 0
+        self.stale_hits = 0
+        self.stale_if_error_hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        self.evictions = 0
+
+    async def get_or_load(
+        self,
+        key: str,
+        loader: Loader,
+        ttl: float,
+        stale_while_revalidate: float = 0.0,
+        stale_if_error: float = 0.0,
+    ) -> Any:
+        now = self.clock()
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            if now < entry.expires_at:
+                self.hits += 1
+                return entry.value
+            if now < entry.expires_at + stale_while_revalidate:
+                self.stale_hits += 1
+                self._schedule_refresh(key, loader, ttl)
+                return entry.value
+
+        self.misses += 1
+        try:
+            return (await self.load(key, loader, ttl)).value
+        except httpx.RequestError:
+            if entry is not None and now < entry.expires_at + stale_if_error:
+                self.stale_if_error_hits += 1
+                return entry.value
+            raise
+
+    async def load(self, key: str, loader: Loader, ttl: float) -> CacheEntry:
+        """Fetch a new value with `loader` and store it under `key`, once for all concurrent callers."""
+        return await self._loads.do(key, lambda: self._load(key, loader, ttl))
+
+    async def _load(self, key: str, loader: Loader, ttl: float) -> CacheEntry:
+        value, size, *loaded_ttl = await loader()
+        return self.put(key, value, size, loaded_ttl[0] if loaded_ttl else ttl)
+
+    def put(self, key: str, value: Any, size: int, ttl: float) -> CacheEntry:
+        """Stores `value` directly; a negative `ttl` stores it already stale."""
+        now = self.clock()
+        entry = CacheEntry(value, size, stored_at=now, expires_at=now + ttl)
+        self._store(key, entry)
+        return entry
+
+    def _store(self, key: str, entry: CacheEntry):
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.total_bytes -= previous.size
+        if entry.size > self.max_bytes:
+            # Never let a single oversized value flush the whole cache
+            return
+        self._entries[key] = entry
+        self.total_bytes += entry.size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.total_bytes -= evicted.size
+            self.evictions += 1
+
+    def _schedule_refresh(self, key: str, loader: Loader, ttl: float):
+        if key in self._refreshing:
+            return
+        task = asyncio.create_task(self._refresh(key, loader, ttl))
+        self._refreshing[key] = task
+        task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+
+    async def _refresh(self, key: str, loader: Loader, ttl: float):
+        self.refreshes += 1
+        try:
+            await self.load(key, loader, ttl)
+        except (httpx.HTTPError, ValueError):
+            # Keep serving the stale entry; the next request retries
+            self.refresh_errors += 1
+
+    def get_entry(self, key: str) -> Optional[CacheEntry]:
+        return self._entries.get(key)
+
+    def invalidate(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    async def close(self):
+        tasks = list(self._refreshing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.stale_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "stale_hits": self.stale_hits,
+            "stale_if_error_hits": self.stale_if_error_hits,
+            "misses": self.misses,
+            "hit_ratio": round((self.hits + self.stale_hits) / lookups, 4) if lookups else 0.0,
+            "refreshes": self.refreshes,
+            "refresh_errors": self.refresh_errors,
+            "refreshing": len(self._refreshing),
+            "loads": self._loads.executions,
+            "loads_coalesced": self._loads.coalesced,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,225 @@
+"""
+Persistent on-disk tier for cached upstream payloads.
+
+Bodies and their compressed variants are stored once each as content-addressed
+blob files (named by their blake2b digest); a small JSON sidecar per cache
+key records which blobs make up the current version together with its
+validators and when it was fetched. Every file is written to a temporary name
+and renamed into place, so readers only ever see complete files.
+
+Blobs are memory-mapped rather than read, so a payload loaded from disk is
+served straight from the page cache without copying, and all workers on the
+host share those pages. The cache survives restarts, and a worker that finds
+a fresher version on disk than its own uses it instead of asking the upstream.
+Which version is current is also published to a shared seqlock index (see
+sharedindex.py), so workers can check for one without reading any file.
+"""
+import hashlib
+import json
+import mmap
+import os
+import tempfile
+import time
+from typing import Iterator, Optional, Union
+
+from payload import Payload
+from sharedindex import SharedIndex
+
+Buffer = Union[bytes, memoryview]
+
+
+def digest_of(data: Buffer) -> str:
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def write_atomic(path: str, data: Buffer):
+    """Writes `data` to `path` via a temporary file and a rename."""
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as tmp_file:
+            tmp_file.write(data)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def map_file(path: str) -> Buffer:
+    """A read-only view of the file's bytes, backed by the page cache."""
+    with open(path, "rb") as blob_file:
+        if os.fstat(blob_file.fileno()).st_size == 0:
+            # Empty files cannot be mapped
+            return b""
+        # The mapping outlives the file object
+        return memoryview(mmap.mmap(blob_file.fileno(), 0, access=mmap.ACCESS_READ))
+
+
+def blobs_of(meta: dict) -> set:
+    """The digests of every blob a sidecar refers to."""
+    return {meta["body"], *meta["encodings"].values()}
+
+
+class StoredPayload:
+    __slots__ = ("payload", "stored_at", "ttl")
+
+    def __init__(self, payload: Payload, stored_at: float, ttl: float):
+        self.payload = payload
+        self.stored_at = stored_at
+        self.ttl = ttl
+
+    def remaining_ttl(self, now: Optional[float] = None) -> float:
+        """Seconds until this version goes stale; negative once it has."""
+        return self.stored_at + self.ttl - (time.time() if now is None else now)
+
+
+class DiskCache:
+    def __init__(self, directory: str, blob_grace: float = 60.0, index_slots: int = 256):
+        self.directory = directory
+        self.blob_dir = os.path.join(directory, "blobs")
+        self.meta_dir = os.path.join(directory, "meta")
+        # Unreferenced blobs younger than this may belong to a sidecar another
+        # worker is about to write, so pruning leaves them alone
+        self.blob_grace = blob_grace
+        os.makedirs(self.blob_dir, exist_ok=True)
+        os.makedirs(self.meta_dir, exist_ok=True)
+        self.index = SharedIndex(os.path.join(directory, "index"), index_slots)
+        self.reads = 0
+        self.read_misses = 0
+        self.writes = 0
+        self.blob_writes = 0
+        self.blobs_deduplicated = 0
+        self.blobs_pruned = 0
+
+    def _meta_path(self, key: str) -> str:
+        return os.path.join(self.meta_dir, hashlib.sha256(key.encode("utf-8")).hexdigest() + ".json")
+
+    def _blob_path(self, digest: str) -> str:
+        return os.path.join(self.blob_dir, digest)
+
+    def _put_blob(self, data: Buffer, digest: Optional[str] = None) -> str:
+        digest = digest or digest_of(data)
+        path = self._blob_path(digest)
+        try:
+            # Refreshing the mtime keeps a concurrent prune() from taking it
+            os.utime(path)
+            self.blobs_deduplicated += 1
+        except FileNotFoundError:
+            write_atomic(path, data)
+            self.blob_writes += 1
+        return digest
+
+    def save(self, key: str, payload: Payload, ttl: float, stored_at: Optional[float] = None):
+        """Persists `payload` as the current version of `key` and publishes it to the index."""
+        stored_at = time.time() if stored_at is None else stored_at
+        meta_path = self._meta_path(key)
+        previous = self._read_meta(meta_path)
+        meta = {
+            "key": key,
+            # The ETag is already the body's blake2b digest
+            "body": self._put_blob(payload.body, payload.etag.strip('"')),
+            "encodings": {name: self._put_blob(data) for name, data in payload.encodings.items()},
+            "media_type": payload.media_type,
+            "last_modified": payload.last_modified,
+            "upstream_etag": payload.upstream_etag,
+            "upstream_last_modified": payload.upstream_last_modified,
+            "stored_at": stored_at,
+            "ttl": ttl,
+        }
+        write_atomic(meta_path, json.dumps(meta).encode("utf-8"))
+        self.writes += 1
+        self.index.publish(key, meta["body"], stored_at, ttl)
+        if previous is not None and blobs_of(previous) - blobs_of(meta):
+            # A new version replaced the old one, whose blobs may now be unreferenced
+            self.prune()
+
+    def _read_meta(self, path: str) -> Optional[dict]:
+        try:
+            with open(path, "rb") as meta_file:
+                return json.loads(meta_file.read())
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def load(self, key: str) -> Optional[StoredPayload]:
+        """The stored version of `key`, with its blobs memory-mapped; None if absent."""
+        meta = self._read_meta(self._meta_path(key))
+        if meta is None or meta.get("key") != key:
+            self.read_misses += 1
+            return None
+        try:
+            body = map_file(self._blob_path(meta["body"]))
+            encodings = {name: map_file(self._blob_path(digest)) for name, digest in meta["encodings"].items()}
+        except FileNotFoundError:
+            # Pruned under us; treat as absent and let the caller refetch
+            self.read_misses += 1
+            return None
+        self.reads += 1
+        payload = Payload(
+            body,
+            media_type=meta["media_type"],
+            encodings=encodings,
+            last_modified=meta["last_modified"],
+            upstream_etag=meta["upstream_etag"],
+            upstream_last_modified=meta["upstream_last_modified"],
+            etag='"' + meta["body"] + '"',
+        )
+        return StoredPayload(payload, meta["stored_at"], meta["ttl"])
+
+    def close(self):
+        self.index.close()
+
+    def keys(self) -> Iterator[str]:
+        for name in os.listdir(self.meta_dir):
+            if name.endswith(".json"):
+                meta = self._read_meta(os.path.join(self.meta_dir, name))
+                if meta is not None:
+                    yield meta["key"]
+
+    def prune(self):
+        """Deletes blobs no sidecar refers to any more."""
+        referenced = set()
+        for name in os.listdir(self.meta_dir):
+            meta = self._read_meta(os.path.join(self.meta_dir, name)) if name.endswith(".json") else None
+            if meta is not None:
+                referenced |= blobs_of(meta)
+        cutoff = time.time() - self.blob_grace
+        for name in os.listdir(self.blob_dir):
+            path = self._blob_path(name)
+            if name in referenced or name.startswith(".tmp-"):
+                continue
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    # Workers still mapping the file keep their pages
+                    os.unlink(path)
+                    self.blobs_pruned += 1
+            except FileNotFoundError:
+                pass
+
+    def _blob_bytes(self) -> int:
+        total = 0
+        for name in os.listdir(self.blob_dir):
+            try:
+                total += os.path.getsize(self._blob_path(name))
+            except FileNotFoundError:
+                pass
+        return total
+
+    def stats(self) -> dict:
+        blobs = [name for name in os.listdir(self.blob_dir) if not name.startswith(".tmp-")]
+        return {
+            "directory": self.directory,
+            "entries": sum(1 for name in os.listdir(self.meta_dir) if name.endswith(".json")),
+            "blobs": len(blobs),
+            "blob_bytes": self._blob_bytes(),
+            "reads": self.reads,
+            "read_misses": self.read_misses,
+            "writes": self.writes,
+            "blob_writes": self.blob_writes,
+            "blobs_deduplicated": self.blobs_deduplicated,
+            "blobs_pruned": self.blobs_pruned,
+            "index": self.index.stats(),
+        }
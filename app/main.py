@@ -1,16 +1,33 @@
 import os
 from dotenv import load_dotenv
-from fastapi import FastAPI, Depends, HTTPException, status, Request
+from fastapi import FastAPI, BackgroundTasks, Depends, HTTPException, status, Request, Query, Response
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
 from fastapi.security import OAuth2PasswordBearer
+from fastapi.security.utils import get_authorization_scheme_param
 from pydantic import BaseModel
-from typing import Optional, Annotated
+from typing import Any, Iterable, Literal, Optional, Annotated
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from datetime import datetime, timedelta, timezone
+from contextlib import AsyncExitStack, asynccontextmanager
 import logging
 from logging.handlers import RotatingFileHandler
 import time
+import asyncio
 import httpx
+from upstream import UpstreamClient, UpstreamSettings
+from cache import CacheSettings, ResponseCache
+from diskcache import DiskCache
+from tokens import RevokedTokens, TokenCache, TokenCacheSettings
+from passwords import PasswordCost, PasswordPool, PasswordPoolFull, PasswordSettings, pwd_context
+from scheduler import PrefetchScheduler, PrefetchSettings
+from payload import JSON_MEDIA_TYPE, NDJSON_MEDIA_TYPE, Payload, QueryError, dumps, ndjson_lines, response_stats
+from photos import PhotoStore, parse_fields
+from posts import PostIndex
+from search import SearchIndex
+from joins import KeyIndex, expand_posts
+from registry import ProxyRoute, load_routes
+from batch import BatchRequest, BatchSettings, batch_stats, run_batch
 
 # --- Load Environment Variables ---
 # This will load variables from a .env file in the same directory
@@ -56,11 +73,53 @@ file_handler.setFormatter(file_formatter)
 logger.addHandler(file_handler)
 
 
+# --- Upstream HTTP Client ---
+# One pooled client for the whole app lifetime, shared by all proxy endpoints.
+upstream = UpstreamClient(UpstreamSettings())
+
+# --- Response Cache ---
+cache_settings = CacheSettings()
+response_cache = ResponseCache(cache_settings.max_entries, cache_settings.max_bytes)
+# Optional persistent tier, shared by the workers on this host and kept across restarts
+disk_cache = (
+    DiskCache(cache_settings.disk_dir, index_slots=cache_settings.shared_slots) if cache_settings.disk_dir else None
+)
+
+# --- Prefetch Scheduler ---
+# Resources are registered next to their endpoints below
+prefetch_scheduler = PrefetchScheduler(PrefetchSettings())
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    await upstream.start()
+    # Before the workers start, so process workers inherit the chosen cost
+    await asyncio.to_thread(password_cost.configure, pwd_context, password_settings)
+    await password_pool.start(warm_up=password_settings.warm_up)
+    if disk_cache is not None:
+        await asyncio.to_thread(warm_from_disk)
+    await prefetch_scheduler.start()
+    yield
+    await prefetch_scheduler.stop()
+    await response_cache.close()
+    await upstream.close()
+    password_pool.close()
+
+
+# --- Verified Token Cache ---
+token_cache_settings = TokenCacheSettings()
+token_cache = TokenCache(token_cache_settings.max_entries if token_cache_settings.enabled else 0)
+revoked_tokens = RevokedTokens(max_token_age=ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+
+
 # --- FastAPI App Initialization ---
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
-# --- Security Schemas (remains the same) ---
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# --- Security Schemas ---
+# bcrypt runs in a bounded pool so it never blocks the event loop
+password_settings = PasswordSettings()
+password_pool = PasswordPool.from_settings(pwd_context, password_settings)
+password_cost = PasswordCost()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 # --- Pydantic Models (remains the same) ---
@@ -100,8 +159,15 @@ def get_user(db, username: str):
         return UserInDB(**user_dict)
     return None
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
+async def verify_password(plain_password, hashed_password):
+    return await password_pool.verify(plain_password, hashed_password)
+
+def password_pool_busy() -> HTTPException:
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Too many password requests in progress, try again shortly",
+        headers={"Retry-After": "1"},
+    )
 
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
@@ -109,29 +175,61 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(minutes=15)
-    to_encode.update({"exp": expire})
+    # Sub-second `iat`, so a revocation only refuses tokens issued before it
+    to_encode.update({"exp": expire, "iat": time.time()})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: Annotated[str, Depends(oauth2_scheme)]):
+def revoke_user_tokens(username: str):
+    """Refuses every token issued to `username` so far; new logins get working tokens."""
+    revoked_tokens.revoke(username)
+    token_cache.invalidate_user(username)
+
+def authenticate(request: Request):
+    """
+    The single authentication stage: verifies the request's bearer token at most
+    once and keeps the outcome on `request.state` (`token`, `claims`, `user`)
+    for the logging middleware and the user dependencies alike.
+    """
+    state = request.state
+    if getattr(state, "authenticated", False):
+        return
+    state.authenticated = True
+    state.token = state.claims = state.user = None
+    # Parsed like OAuth2PasswordBearer does, so the scheme is case-insensitive
+    scheme, token = get_authorization_scheme_param(request.headers.get("Authorization"))
+    if scheme.lower() != "bearer" or not token:
+        return
+    state.token = token
+    claims = token_cache.get(token)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        except JWTError:
+            return
+        # Revoking drops a user's cached tokens, and revoked ones are never
+        # cached again, so only verified tokens need checking
+        if revoked_tokens.is_revoked(claims):
+            return
+        token_cache.put(token, claims)
+    state.claims = claims
+    username = state.claims.get("sub")
+    if username is not None:
+        state.user = get_user(fake_users_db, username=username)
+
+async def get_current_user(request: Request, token: Annotated[str, Depends(oauth2_scheme)]):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get("sub")
-        if username is None:
-            raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
-    if user is None:
+    # Normally already done by the middleware; sub-requests of a /batch call
+    # arrive with the state of the batch
+    authenticate(request)
+    if request.state.user is None:
         raise credentials_exception
 
-    return user
+    return request.state.user
 
 async def get_current_active_user(current_user: Annotated[User, Depends(get_current_user)]):
     if current_user.disabled:
@@ -148,14 +246,12 @@ async def log_api_usage(request: Request, call_next):
     http_method = request.method
     status_code = "N/A"
 
-    authorization: Optional[str] = request.headers.get("Authorization")
-    if authorization and authorization.startswith("Bearer "):
-        token = authorization.split(" ")[1]
-        api_key_used = token
-        try:
-            payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-            user_identifier = payload.get("sub", "unknown_token_user")
-        except JWTError:
+    authenticate(request)
+    if request.state.token is not None:
+        api_key_used = request.state.token
+        if request.state.claims is not None:
+            user_identifier = request.state.claims.get("sub", "unknown_token_user")
+        else:
             user_identifier = "invalid_token"
 
     if endpoint_path == "/token" and request.method == "POST":
@@ -213,7 +309,16 @@ async def register_user(user_data_in: UserRegister):
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Username already registered"
         )
-    hashed_password = pwd_context.hash(user_data_in.password)
+    try:
+        hashed_password = await password_pool.hash(user_data_in.password)
+    except PasswordPoolFull:
+        raise password_pool_busy()
+    if user_data_in.username in fake_users_db:
+        # Registered by a concurrent request while the password was hashing
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered"
+        )
     user_data = {
         "username": user_data_in.username,
         "hashed_password": hashed_password,
@@ -226,14 +331,21 @@ async def register_user(user_data_in: UserRegister):
 
 
 @app.post("/token", response_model=Token)
-async def login_for_access_token(user_login: UserLogin):
+async def login_for_access_token(user_login: UserLogin, background_tasks: BackgroundTasks):
     user = get_user(fake_users_db, user_login.username)
-    if not user or not verify_password(user_login.password, user.hashed_password):
+    try:
+        verified = user is not None and await verify_password(user_login.password, user.hashed_password)
+    except PasswordPoolFull:
+        raise password_pool_busy()
+    if not verified:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    if pwd_context.needs_update(user.hashed_password):
+        # Upgraded to the current cost after the response has been sent
+        background_tasks.add_task(rehash_password, user.username, user_login.password, user.hashed_password)
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -241,6 +353,19 @@ async def login_for_access_token(user_login: UserLogin):
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+async def rehash_password(username: str, password: str, outdated_hash: str):
+    try:
+        hashed_password = await password_pool.hash(password)
+    except PasswordPoolFull:
+        # Tried again on the next login
+        return
+    user_data = fake_users_db.get(username)
+    # Unless the password was changed meanwhile
+    if user_data is not None and user_data["hashed_password"] == outdated_hash:
+        user_data["hashed_password"] = hashed_password
+        password_cost.rehashes += 1
+
+
 @app.get("/users/me/", response_model=User)
 async def read_users_me(current_user: Annotated[User, Depends(get_current_active_user)]):
     return current_user
@@ -254,49 +379,465 @@ async def read_own_items(current_user: Annotated[User, Depends(get_current_activ
 async def root():
     return {"message": "Welcome to the JWT Authentication API!"}
 
-# --- New Endpoints Requiring JWT Authentication (remains the same) ---
-@app.get("/photos")
-async def get_photos(current_user: Annotated[User, Depends(get_current_active_user)]):
+@app.get("/metrics")
+async def metrics():
     """
-    Fetches photos from JSONPlaceholder. Requires JWT authentication.
+    Runtime statistics for the performance subsystems, for scraping.
     """
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get("https://jsonplaceholder.typicode.com/photos")
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Error fetching photos for user {current_user.username}: {e.response.status_code} - {e.response.text}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to fetch photos from external API"
-            )
-        except httpx.RequestError as e:
-            logger.error(f"Network error fetching photos for user {current_user.username}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Could not connect to external photo API"
-            )
+    photos_route = next((route for route in proxy_routes.values() if route.index == "photos"), None)
+    photos_entry = response_cache.get_entry(photos_route.upstream) if photos_route is not None else None
+    photo_store = photos_entry.value.derived.get("photos") if photos_entry is not None else None
+    return {
+        "upstream": upstream.stats(),
+        "cache": response_cache.stats(),
+        "responses": response_stats.stats(),
+        "photo_store": photo_store.memory_report() if photo_store is not None else None,
+        "search": {name: index.stats() for name, index in search_indexes.items()},
+        "prefetch": prefetch_scheduler.stats(),
+        "disk_cache": disk_cache.stats() if disk_cache is not None else None,
+        "token_cache": token_cache.stats(),
+        "revoked_tokens": revoked_tokens.stats(),
+        "password_pool": password_pool.stats(),
+        "password_cost": password_cost.stats(),
+        "batch": batch_stats.stats(),
+    }
+
+# --- Proxied Upstream Endpoints ---
+# Declared in proxy_routes.yaml (see registry.py) and mounted below
+proxy_routes = load_routes()
+
+# Full-text indexes over cached "posts"-indexed routes, updated incrementally when they change
+search_indexes: dict[str, SearchIndex] = {}
+
+def warm_from_disk():
+    """
+    Seeds the response cache with the versions persisted on disk, aged by how
+    long ago they were fetched, so a restarted worker does not stampede the upstream.
+    """
+    for route in proxy_routes.values():
+        if route.stream:
+            continue
+        stored = disk_cache.load(route.upstream)
+        if stored is not None:
+            response_cache.put(route.upstream, stored.payload, stored.payload.size, stored.remaining_ttl())
+    disk_cache.prune()
+
+async def persist_payload(route: ProxyRoute, payload: Payload) -> Payload:
+    """
+    Saves a fetched version to the shared tier and returns it memory-mapped from
+    there, so every worker serves the same pages instead of a private copy.
+    """
+    def save_and_map():
+        disk_cache.save(route.upstream, payload, route.ttl)
+        stored = disk_cache.load(route.upstream)
+        return stored.payload if stored is not None and stored.payload.etag == payload.etag else payload
+
+    try:
+        return await asyncio.to_thread(save_and_map)
+    except OSError as e:
+        # The disk tier is an optimisation; keep serving from memory
+        logger.warning(f"Could not persist {route.name} to the disk cache: {e}")
+        return payload
+
+async def adopt_shared_version(route: ProxyRoute, previous: Optional[Payload], min_remaining: float = 0.0):
+    """
+    A cache load result for a version of the route already fetched by some
+    worker with more than `min_remaining` seconds of its TTL left, or None. The
+    shared index is checked first, without any file access.
+    """
+    state = disk_cache.index.read(route.upstream)
+    if state is not None and state.digest:
+        remaining = state.remaining_ttl()
+        if remaining <= min_remaining:
+            return None
+        if previous is not None and previous.etag == state.etag:
+            # Keep our own copy (and the indexes derived from it)
+            return previous, previous.size, remaining
+    stored = await asyncio.to_thread(disk_cache.load, route.upstream)
+    if stored is None or stored.remaining_ttl() <= min_remaining:
+        return None
+    if previous is not None and previous.etag == stored.payload.etag:
+        return previous, previous.size, stored.remaining_ttl()
+    return stored.payload, stored.payload.size, stored.remaining_ttl()
+
+async def wait_for_shared_version(route: ProxyRoute, previous: Optional[Payload], min_remaining: float = 0.0):
+    """Waits, up to the route's deadline, for the worker holding the refresh lease to publish."""
+    deadline = time.monotonic() + route.deadline
+    while time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+        state = disk_cache.index.read(route.upstream)
+        if state is None or not state.leased():
+            return await adopt_shared_version(route, previous, min_remaining)
+    return None
 
-@app.get("/posts")
-async def get_posts(current_user: Annotated[User, Depends(get_current_active_user)]):
+async def fetch_upstream_payload(route: ProxyRoute, min_remaining: float = 0.0):
     """
-    Fetches posts from JSONPlaceholder. Requires JWT authentication.
+    Loads a JSON document from the upstream as pre-serialized bytes for the response cache.
+
+    When an earlier version is cached, the upstream is asked conditionally and a
+    304 simply renews the cached version.
+
+    With the shared disk tier enabled, a version another worker fetched recently
+    is used instead of asking the upstream. Otherwise one worker takes the
+    refresh lease and calls the upstream while the others wait for its result.
+    A shared version with no more than `min_remaining` seconds of its TTL left
+    does not count, so a refresh ahead of expiry really refreshes.
     """
-    async with httpx.AsyncClient() as client:
+    url = route.upstream
+    previous_entry = response_cache.get_entry(url)
+    previous = previous_entry.value if previous_entry is not None else None
+    if disk_cache is None:
+        return await fetch_from_upstream(route, previous)
+
+    shared = await adopt_shared_version(route, previous, min_remaining)
+    if shared is not None:
+        return shared
+    if not disk_cache.index.try_lease(url, route.deadline):
+        shared = await wait_for_shared_version(route, previous, min_remaining)
+        if shared is not None:
+            return shared
+        # The refreshing worker failed or timed out; try ourselves
+    try:
+        if previous is None:
+            # Stale, but its validators still allow a conditional request
+            stored = await asyncio.to_thread(disk_cache.load, url)
+            previous = stored.payload if stored is not None else None
+        payload, _ = await fetch_from_upstream(route, previous)
+        mapped = await persist_payload(route, payload)
+        if previous_entry is None or payload is not previous_entry.value:
+            # Serve the shared mapping rather than a private copy; a version we
+            # already held keeps the indexes derived from it
+            payload = mapped
+        return payload, payload.size
+    finally:
+        # Publishing ends the lease; this only matters when the fetch failed
+        disk_cache.index.release(url)
+
+async def fetch_from_upstream(route: ProxyRoute, previous: Optional[Payload]):
+    url = route.upstream
+    if previous is not None:
+        response = await upstream.revalidate(url, previous.upstream_etag, previous.upstream_last_modified, route.deadline)
+        if response.status_code == 304:
+            return previous, previous.size
+    else:
+        response = await upstream.revalidate(url, deadline=route.deadline)
+    response.raise_for_status()
+    # Normalizing and compressing a large body takes a few milliseconds; keep it off the event loop
+    payload = await asyncio.to_thread(
+        Payload.from_upstream,
+        response.content,
+        normalize=cache_settings.normalize_json,
+        compress=cache_settings.compress and route.compress,
+        min_size=cache_settings.compress_min_bytes,
+        gzip_level=cache_settings.gzip_level,
+        brotli_quality=cache_settings.brotli_quality,
+        upstream_etag=response.headers.get("etag"),
+        upstream_last_modified=response.headers.get("last-modified"),
+    )
+    if previous is not None and previous.etag == payload.etag:
+        # Unchanged upstream content keeps its version, so client validators stay valid
+        previous.upstream_etag = payload.upstream_etag
+        previous.upstream_last_modified = payload.upstream_last_modified
+        payload = previous
+    return payload, payload.size
+
+async def get_cached_payload(route: ProxyRoute) -> Payload:
+    return await response_cache.get_or_load(
+        route.upstream,
+        lambda: fetch_upstream_payload(route),
+        ttl=route.ttl,
+        stale_while_revalidate=(
+            cache_settings.stale_while_revalidate if route.stale_while_revalidate is None else route.stale_while_revalidate
+        ),
+        stale_if_error=cache_settings.stale_if_error if route.stale_if_error is None else route.stale_if_error,
+    )
+
+def register_prefetch(route: ProxyRoute):
+    # Refreshing ahead of expiry must not just re-adopt the version about to expire
+    min_remaining = prefetch_scheduler.refresh_window(route.ttl)
+
+    async def refresh():
+        await response_cache.load(route.upstream, lambda: fetch_upstream_payload(route, min_remaining), route.ttl)
+
+    prefetch_scheduler.register(route.name, refresh, route.ttl)
+
+async def get_derived(payload: Payload, name: str, build):
+    """
+    Returns an index derived from a cached payload, building it off the event loop on first use.
+    """
+    value = payload.derived.get(name)
+    if value is None:
+        value = await asyncio.to_thread(payload.derive, name, build)
+    return value
+
+def page_response(body: bytes, next_cursor: Optional[str]) -> Response:
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    return Response(content=body, media_type=JSON_MEDIA_TYPE, headers=headers)
+
+async def load_upstream_payload(route: ProxyRoute, current_user: Optional[User]) -> Payload:
+    """
+    Returns the cached upstream payload, turning upstream failures into HTTP errors.
+    """
+    try:
+        return await get_cached_payload(route)
+    except httpx.HTTPError as e:
+        raise upstream_http_error(route, current_user, e)
+
+def upstream_http_error(route: ProxyRoute, current_user: Optional[User], e: httpx.HTTPError) -> HTTPException:
+    """Maps an upstream failure to the HTTP error returned to the client."""
+    resource = route.resource
+    username = current_user.username if current_user is not None else "anonymous"
+    if isinstance(e, httpx.HTTPStatusError):
+        logger.error(f"Error fetching {resource}s for user {username}: {e.response.status_code} - {e.response.text}")
+        return HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Failed to fetch {resource}s from external API"
+        )
+    logger.error(f"Network error fetching {resource}s for user {username}: {e}")
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=f"Could not connect to external {resource} API"
+    )
+
+# Upstream headers forwarded on streamed pass-through responses
+STREAMED_HEADERS = ("content-type", "content-encoding", "content-length", "etag", "last-modified")
+
+async def stream_upstream(route: ProxyRoute, request: Request, current_user: Optional[User]) -> StreamingResponse:
+    """
+    Pipes the upstream body to the client as it arrives, so memory per request
+    stays constant whatever the payload size.
+    """
+    # Raw bytes are forwarded, so only ask for encodings the client can decode
+    headers = {"Accept-Encoding": request.headers.get("accept-encoding", "identity")}
+    stack = AsyncExitStack()
+    try:
+        upstream_response = await stack.enter_async_context(upstream.stream(route.upstream, headers, route.deadline))
+        if upstream_response.status_code >= 400:
+            await upstream_response.aread()
+            upstream_response.raise_for_status()
+    except httpx.HTTPError as e:
+        await stack.aclose()
+        raise upstream_http_error(route, current_user, e)
+
+    async def body():
         try:
-            response = await client.get("https://jsonplaceholder.typicode.com/posts")
-            response.raise_for_status()
-            return response.json()
-        except httpx.HTTPStatusError as e:
-            logger.error(f"Error fetching posts for user {current_user.username}: {e.response.status_code} - {e.response.text}")
-            raise HTTPException(
-                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-                detail="Failed to fetch posts from external API"
+            async for chunk in upstream_response.aiter_raw():
+                yield chunk
+        finally:
+            await stack.aclose()
+
+    return StreamingResponse(
+        body(),
+        status_code=upstream_response.status_code,
+        headers={name: upstream_response.headers[name] for name in STREAMED_HEADERS if name in upstream_response.headers},
+        # Also releases the upstream connection when the client goes away mid-body
+        background=BackgroundTask(stack.aclose),
+    )
+
+def ndjson_response(records: Iterable[bytes], next_cursor: Optional[str]) -> StreamingResponse:
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor is not None else None
+    return StreamingResponse(ndjson_lines(records), media_type=NDJSON_MEDIA_TYPE, headers=headers)
+
+# `format=ndjson` streams one record per line instead of a JSON array
+OutputFormat = Annotated[Literal["json", "ndjson"], Query(alias="format")]
+
+async def no_user() -> None:
+    """Stands in for the user dependency on routes that do not require authentication."""
+    return None
+
+def proxy_endpoints(route: ProxyRoute) -> list[tuple[str, Any]]:
+    """
+    Builds the (path, handler) pairs serving one route, according to its index.
+    """
+    UserDep = Annotated[Optional[User], Depends(get_current_active_user if route.auth else no_user)]
+
+    if route.index == "photos":
+        async def get_items(
+            request: Request,
+            current_user: UserDep,
+            album_id: Annotated[Optional[int], Query(alias="albumId")] = None,
+            limit: Annotated[Optional[int], Query(ge=1)] = None,
+            cursor: Optional[str] = None,
+            fields: Optional[str] = None,
+            output_format: OutputFormat = "json",
+        ):
+            """
+            Optionally filtered by `albumId`, paginated with `limit`/`cursor` (the next
+            cursor is returned in the `X-Next-Cursor` header), projected to a
+            comma-separated list of `fields` and streamed as NDJSON with `format=ndjson`.
+            """
+            payload = await load_upstream_payload(route, current_user)
+            if album_id is None and limit is None and cursor is None and fields is None and output_format == "json":
+                return payload.to_response(request.headers)
+            store = await get_derived(payload, "photos", PhotoStore.from_payload)
+            try:
+                if output_format == "ndjson":
+                    names = parse_fields(fields)
+                    rows, next_cursor = store.select(album_id, limit, cursor)
+                    return ndjson_response(store.iter_rows(rows, names), next_cursor)
+                return page_response(*store.query(album_id, limit, cursor, fields))
+            except QueryError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        return [(route.path, get_items)]
+
+    if route.index == "posts":
+        search_index = search_indexes[route.name] = SearchIndex()
+
+        async def get_items(
+            request: Request,
+            current_user: UserDep,
+            user_id: Annotated[Optional[int], Query(alias="userId")] = None,
+            item_id: Annotated[Optional[int], Query(alias="id")] = None,
+            limit: Annotated[Optional[int], Query(ge=1)] = None,
+            cursor: Optional[str] = None,
+            output_format: OutputFormat = "json",
+        ):
+            """
+            Optionally filtered by `userId` and/or `id`, paginated with
+            `limit`/`cursor` and streamed as NDJSON with `format=ndjson`,
+            answered from indexes over the cached data.
+            """
+            payload = await load_upstream_payload(route, current_user)
+            if user_id is None and item_id is None and limit is None and cursor is None and output_format == "json":
+                return payload.to_response(request.headers)
+            index = await get_derived(payload, "posts", PostIndex.from_payload)
+            try:
+                if output_format == "ndjson":
+                    positions, next_cursor = index.page(user_id, item_id, limit, cursor)
+                    return ndjson_response((index.encoded[position] for position in positions), next_cursor)
+                return page_response(*index.query(user_id, item_id, limit, cursor))
+            except QueryError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+        async def search_items(
+            current_user: UserDep,
+            q: Annotated[str, Query(min_length=1)],
+            limit: Annotated[int, Query(ge=1, le=100)] = 10,
+        ):
+            """
+            Full-text search over titles and bodies, ranked by BM25.
+            """
+            payload = await load_upstream_payload(route, current_user)
+            index = await get_derived(payload, "posts", PostIndex.from_payload)
+            if search_index.version != payload.etag:
+                # Only changed documents are re-tokenized. Kept on the event loop so no
+                # search ever sees a half-updated index.
+                documents = {post.get("id"): f"{post.get('title', '')}\n{post.get('body', '')}" for post in index.posts}
+                search_index.update(documents, version=payload.etag)
+            results = [
+                {**index.posts[index.by_id[doc_id]], "score": round(score, 4)}
+                for doc_id, score in search_index.search(q, limit)
+            ]
+            return Response(content=dumps(results), media_type=JSON_MEDIA_TYPE)
+
+        async def get_item(item_id: int, current_user: UserDep):
+            """
+            Fetches a single item from the cached data.
+            """
+            payload = await load_upstream_payload(route, current_user)
+            index = await get_derived(payload, "posts", PostIndex.from_payload)
+            item = index.get(item_id)
+            if item is None:
+                raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"{route.resource.capitalize()} not found")
+            return Response(content=item, media_type=JSON_MEDIA_TYPE)
+
+        async def get_expanded(
+            current_user: UserDep,
+            user_id: Annotated[Optional[int], Query(alias="userId")] = None,
+            item_id: Annotated[Optional[int], Query(alias="id")] = None,
+            limit: Annotated[int, Query(ge=1, le=100)] = 10,
+            cursor: Optional[str] = None,
+        ):
+            """
+            Items with their `comments` and `author` nested, with the same filters
+            and pagination. The three datasets are loaded concurrently through the
+            cache and joined on hash indexes built once per cached version.
+            """
+            items_payload, comments_payload, authors_payload = await asyncio.gather(
+                load_upstream_payload(route, current_user),
+                load_upstream_payload(comments_route, current_user),
+                load_upstream_payload(authors_route, current_user),
             )
-        except httpx.RequestError as e:
-            logger.error(f"Network error fetching posts for user {current_user.username}: {e}")
-            raise HTTPException(
-                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
-                detail="Could not connect to external post API"
+            index, comments, authors = await asyncio.gather(
+                get_derived(items_payload, "posts", PostIndex.from_payload),
+                get_derived(comments_payload, "by_postId", KeyIndex.builder("postId")),
+                get_derived(authors_payload, "by_id", KeyIndex.builder("id")),
             )
+            try:
+                positions, next_cursor = index.page(user_id, item_id, limit, cursor)
+            except QueryError as e:
+                raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+            return page_response(expand_posts(index.posts, index.encoded, positions, comments, authors), next_cursor)
+
+        endpoints = [(route.path, get_items), (f"{route.path}/search", search_items)]
+        if route.expand is not None:
+            comments_route = proxy_routes[route.expand.comments]
+            authors_route = proxy_routes[route.expand.authors]
+            endpoints.append((f"{route.path}/expanded", get_expanded))
+        # /search and /expanded are mounted before /{item_id} so they are not taken for an id
+        return endpoints + [(f"{route.path}/{{item_id}}", get_item)]
+
+    if route.stream:
+        async def get_items(request: Request, current_user: UserDep):
+            return await stream_upstream(route, request, current_user)
+
+        return [(route.path, get_items)]
+
+    async def get_items(request: Request, current_user: UserDep):
+        payload = await load_upstream_payload(route, current_user)
+        return payload.to_response(request.headers)
+
+    return [(route.path, get_items)]
+
+def mount_proxy_route(route: ProxyRoute):
+    if route.prefetch and not route.stream:
+        register_prefetch(route)
+    if route.path is None:
+        return
+    requirement = " Requires JWT authentication." if route.auth else ""
+    for path, endpoint in proxy_endpoints(route):
+        app.add_api_route(
+            path,
+            endpoint,
+            methods=["GET"],
+            name=f"{route.name}:{endpoint.__name__}",
+            description=((route.description or "") + requirement + "\n\n" + (endpoint.__doc__ or "")).strip(),
+        )
+
+for proxy_route in proxy_routes.values():
+    mount_proxy_route(proxy_route)
+
+# --- Batch Endpoint ---
+batch_settings = BatchSettings()
+
+@app.post("/batch")
+async def batch(
+    request: Request,
+    batch_request: BatchRequest,
+    current_user: Annotated[User, Depends(get_current_active_user)],
+):
+    """
+    Resolves several GET sub-requests concurrently in one call. Requires JWT authentication.
+
+    Streams one NDJSON line per sub-request, in completion order, with its
+    `id`, `status`, `duration_ms` and `body`.
+    """
+    if len(batch_request.requests) > batch_settings.max_requests:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Too many sub-requests (max {batch_settings.max_requests})",
+        )
+    authorization = request.headers.get("authorization", "").encode("latin-1")
+    return StreamingResponse(
+        run_batch(
+            app.router,
+            request.scope,
+            batch_request,
+            authorization,
+            # Sub-requests reuse this request's authentication
+            dict(request.scope["state"]),
+            batch_settings.max_concurrency,
+        ),
+        media_type=NDJSON_MEDIA_TYPE,
+    )
@@ -0,0 +1,346 @@
+"""
+Password hashing off the event loop.
+
+bcrypt is deliberately slow (hundreds of milliseconds per hash or verify),
+so running it inside an async handler stalls every other request on the
+worker. Hashes and verifications run in a small dedicated pool instead. The
+pool admits a bounded number of waiting jobs; beyond that callers get
+PasswordPoolFull straight away (turned into a 503) rather than queueing
+behind work that could not finish within any reasonable latency.
+
+The pool runs on a pluggable engine: threads (bcrypt releases the GIL, but
+the worker process still caps how many cores it gets) or a process pool
+sized to the CPU count. At most one batch per worker is in flight; jobs that
+arrive while every worker is busy wait in the queue. On the process engine
+they are handed over several at a time (no more than a worker's share of the
+queue), so under load the per-job cost of dispatching to another process is
+shared by a whole batch.
+
+The bcrypt cost is picked per host at startup: the highest cost whose verify
+time still fits PASSWORD_TARGET_VERIFY_MS. Hashes stored at a lower cost
+report needs_update() and are rehashed the next time their owner logs in.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from multiprocessing import get_context
+from typing import Any, Callable, Literal, Optional
+
+from passlib.context import CryptContext
+from passlib.hash import bcrypt
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+# (operation name, arguments) as sent to a worker, and its (ok, result or exception)
+Job = tuple[str, tuple]
+Outcome = tuple[bool, Any]
+
+
+class PasswordSettings(BaseSettings):
+    """Password pool sizing, overridable with PASSWORD_* env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="PASSWORD_")
+
+    engine: Literal["thread", "process"] = "thread"
+    # Defaults to the CPU count for processes, and up to 4 threads
+    workers: Optional[int] = None
+    # Jobs allowed to wait for a worker before new ones are refused
+    max_queue: int = 64
+    # Most jobs handed to a worker at once; defaults to 8 for processes and
+    # 1 for threads, which gain nothing from batching
+    batch_size: Optional[int] = None
+    # Start every worker (and load the bcrypt backend in it) at startup
+    warm_up: bool = True
+    # Fixed bcrypt cost; when unset it is calibrated at startup
+    rounds: Optional[int] = None
+    # Verify time the calibrated cost has to fit in
+    target_verify_ms: float = 250.0
+    # Bounds for the calibrated cost
+    min_rounds: int = 10
+    max_rounds: int = 16
+
+    def worker_count(self) -> int:
+        if self.workers is not None:
+            return self.workers
+        cpus = os.cpu_count() or 1
+        return cpus if self.engine == "process" else min(4, cpus)
+
+
+
+class PasswordPoolFull(Exception):
+    """Raised instead of queueing a job when the pool's queue is at its limit."""
+
+
+# The context used by process-pool workers, set up by init_worker
+worker_context: Optional[CryptContext] = None
+
+
+def init_worker(config: str):
+    global worker_context
+    worker_context = CryptContext.from_string(config)
+
+
+def run_jobs(jobs: list[Job], context: Optional[CryptContext] = None) -> list[Outcome]:
+    """Runs a batch of password jobs; in a worker process unless given a context."""
+    context = context or worker_context
+    outcomes = []
+    for operation, args in jobs:
+        try:
+            outcomes.append((True, getattr(context, operation)(*args)))
+        except Exception as e:
+            outcomes.append((False, e))
+    return outcomes
+
+
+class ThreadEngine:
+    name = "thread"
+    # A thread gains nothing from being handed several jobs at once
+    default_batch_size = 1
+
+    def __init__(self, context: CryptContext, workers: int):
+        self.context = context
+        self.workers = workers
+
+    def create_executor(self) -> Executor:
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+
+    def runner(self):
+        return partial(run_jobs, context=self.context)
+
+
+class ProcessEngine:
+    name = "process"
+    default_batch_size = 8
+
+    def __init__(self, context: CryptContext, workers: int):
+        self.context = context
+        self.workers = workers
+
+    def create_executor(self) -> Executor:
+        # Spawned rather than forked: the parent runs an event loop and threads
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=get_context("spawn"),
+            initializer=init_worker,
+            initargs=(self.context.to_string(),),
+        )
+
+    def runner(self):
+        return run_jobs
+
+
+ENGINES = {"thread": ThreadEngine, "process": ProcessEngine}
+
+
+class PasswordPool:
+    def __init__(self, context: CryptContext, engine: str = "thread", workers: int = 4, max_queue: int = 64, batch_size: Optional[int] = None):
+        self.context = context
+        self.engine = ENGINES[engine](context, workers)
+        self.workers = workers
+        self.max_queue = max_queue
+        self.batch_size = batch_size or self.engine.default_batch_size
+        self._executor: Optional[Executor] = None
+        # Jobs waiting for a worker: (job, future, submitted_at)
+        self._queue: deque = deque()
+        self._batches: set[asyncio.Task] = set()
+        self.running = 0
+        self.peak_queued = 0
+        self.submitted = 0
+        self.completed = 0
+        self.rejected = 0
+        self.batches = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.run_seconds = 0.0
+        self.warm_up_seconds: Optional[float] = None
+
+    @classmethod
+    def from_settings(cls, context: CryptContext, settings: PasswordSettings) -> "PasswordPool":
+        return cls(context, settings.engine, settings.worker_count(), settings.max_queue, settings.batch_size)
+
+    @property
+    def executor(self) -> Executor:
+        if self._executor is None:
+            self._executor = self.engine.create_executor()
+        return self._executor
+
+    @property
+    def queued(self) -> int:
+        return len(self._queue)
+
+    async def start(self, warm_up: bool = True):
+        """Creates the workers, and with `warm_up` has each of them hash once."""
+        if not warm_up:
+            self.executor
+            return
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        runner = self.engine.runner()
+        # One job per worker, submitted together, brings every worker up
+        await asyncio.gather(*(
+            loop.run_in_executor(self.executor, runner, [("hash", ("warm-up",))]) for _ in range(self.workers)
+        ))
+        self.warm_up_seconds = time.perf_counter() - started
+
+    def close(self):
+        for _, future, _ in self._queue:
+            future.cancel()
+        self._queue.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, operation: str, *args) -> Any:
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise PasswordPoolFull(f"{len(self._queue)} password jobs already waiting")
+        future = asyncio.get_running_loop().create_future()
+        self._queue.append(((operation, args), future, time.perf_counter()))
+        self.submitted += 1
+        self.peak_queued = max(self.peak_queued, len(self._queue))
+        self._dispatch()
+        return await future
+
+    def _dispatch(self):
+        # One batch per worker at a time, so queued jobs are exactly those
+        # no worker has picked up yet. A worker takes at most its share of the
+        # queue, so a burst is spread over all workers as they free up rather
+        # than run one after another by whichever is free first
+        while self._queue and len(self._batches) < self.workers:
+            limit = min(self.batch_size, math.ceil(len(self._queue) / self.workers))
+            batch = []
+            while self._queue and len(batch) < limit:
+                job, future, submitted_at = self._queue.popleft()
+                if not future.cancelled():
+                    batch.append((job, future, submitted_at))
+            if not batch:
+                continue
+            task = asyncio.create_task(self._run_batch(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._batches.discard(task)
+        self._dispatch()
+
+    async def _run_batch(self, batch: list):
+        started = time.perf_counter()
+        for _, _, submitted_at in batch:
+            wait = started - submitted_at
+            self.wait_seconds += wait
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+        self.running += len(batch)
+        self.batches += 1
+        jobs = [job for job, _, _ in batch]
+        try:
+            outcomes = await asyncio.get_running_loop().run_in_executor(self.executor, self.engine.runner(), jobs)
+        except Exception as e:
+            # The worker itself failed (e.g. a crashed process)
+            outcomes = [(False, e)] * len(batch)
+        finally:
+            self.running -= len(batch)
+        self.run_seconds += time.perf_counter() - started
+        self.completed += len(batch)
+        for (_, future, _), (ok, result) in zip(batch, outcomes):
+            if future.cancelled():
+                continue
+            if ok:
+                future.set_result(result)
+            else:
+                future.set_exception(result)
+
+    async def hash(self, secret: str) -> str:
+        return await self.run("hash", secret)
+
+    async def verify(self, secret: str, hashed: str) -> bool:
+        return await self.run("verify", secret, hashed)
+
+    def stats(self) -> dict:
+        completed = self.completed
+        return {
+            "engine": self.engine.name,
+            "workers": self.workers,
+            "running": self.running,
+            "queued": self.queued,
+            "peak_queued": self.peak_queued,
+            "max_queue": self.max_queue,
+            "utilization": round(len(self._batches) / self.workers, 4) if self.workers else 0.0,
+            "submitted": self.submitted,
+            "completed": completed,
+            "rejected": self.rejected,
+            "batches": self.batches,
+            "avg_batch_size": round(completed / self.batches, 2) if self.batches else 0.0,
+            "avg_queue_wait_ms": round(self.wait_seconds / completed * 1000, 3) if completed else 0.0,
+            "max_queue_wait_ms": round(self.max_wait_seconds * 1000, 3),
+            "avg_batch_run_ms": round(self.run_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+            "warm_up_ms": round(self.warm_up_seconds * 1000, 1) if self.warm_up_seconds is not None else None,
+        }
+
+
+def time_verify(rounds: int) -> float:
+    """Seconds one bcrypt verification takes at `rounds` on this host."""
+    hashed = bcrypt.using(rounds=rounds).hash("calibration")
+    started = time.perf_counter()
+    bcrypt.verify("calibration", hashed)
+    return time.perf_counter() - started
+
+
+def calibrate(target_ms: float, min_rounds: int, max_rounds: int, measure: Callable[[int], float] = time_verify) -> tuple[int, float]:
+    """
+    The highest cost in [min_rounds, max_rounds] whose verify time fits in
+    `target_ms`, with its measured time in milliseconds. Each extra round
+    doubles the work, so costs are only measured while doubling could still fit.
+    """
+    rounds = min_rounds
+    elapsed_ms = measure(rounds) * 1000
+    while rounds < max_rounds and elapsed_ms * 2 <= target_ms:
+        candidate_ms = measure(rounds + 1) * 1000
+        if candidate_ms > target_ms:
+            break
+        rounds, elapsed_ms = rounds + 1, candidate_ms
+    return rounds, elapsed_ms
+
+
+class PasswordCost:
+    """The bcrypt cost in use, how it was chosen and how many hashes were upgraded to it."""
+
+    def __init__(self):
+        self.rounds: Optional[int] = None
+        self.source = "default"
+        self.target_verify_ms: Optional[float] = None
+        self.verify_ms: Optional[float] = None
+        self.calibration_seconds: Optional[float] = None
+        self.rehashes = 0
+
+    def configure(self, context: CryptContext, settings: PasswordSettings):
+        """
+        Sets the cost of new hashes in `context`, calibrating it unless fixed
+        by PASSWORD_ROUNDS. Hashes below that cost then need an update.
+        Blocks for about twice the target verify time, so run it in a thread.
+        """
+        if settings.rounds is not None:
+            self.rounds, self.source = settings.rounds, "configured"
+        else:
+            started = time.perf_counter()
+            self.rounds, self.verify_ms = calibrate(settings.target_verify_ms, settings.min_rounds, settings.max_rounds)
+            self.calibration_seconds = time.perf_counter() - started
+            self.target_verify_ms = settings.target_verify_ms
+            self.source = "calibrated"
+        # Only an upgrade is enforced, so hosts that calibrate differently
+        # don't keep rehashing each other's hashes
+        context.update(bcrypt__default_rounds=self.rounds, bcrypt__min_rounds=self.rounds)
+
+    def stats(self) -> dict:
+        return {
+            "rounds": self.rounds,
+            "source": self.source,
+            "target_verify_ms": self.target_verify_ms,
+            "verify_ms": round(self.verify_ms, 1) if self.verify_ms is not None else None,
+            "calibration_ms": round(self.calibration_seconds * 1000, 1) if self.calibration_seconds is not None else None,
+            "rehashes": self.rehashes,
+        }
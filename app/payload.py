@@ -0,0 +1,293 @@
+"""
+Pre-serialized upstream payloads.
+
+The upstream body is kept as bytes and served through a raw Response, so a
+cached payload is never parsed or re-encoded per request. Everything a
+response needs (length, validators, compressed variants) is computed once
+when the payload is built, so conditional requests are answered with a 304
+from the headers alone.
+"""
+import gzip
+import hashlib
+import json
+import time
+from email.utils import formatdate, parsedate_to_datetime
+from typing import Any, Callable, Iterable, Iterator, Mapping, Optional, Union
+
+from fastapi import Response
+
+try:
+    import orjson
+except ImportError:  # orjson is optional; bodies are then served as received
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; only gzip variants are built then
+    brotli = None
+
+JSON_MEDIA_TYPE = "application/json"
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+class QueryError(ValueError):
+    """Query parameters that cannot be applied to a cached dataset."""
+
+
+def parse_cursor(cursor: Optional[str]) -> int:
+    """Decodes a pagination cursor (a row position) handed out with a previous page."""
+    if cursor is None:
+        return 0
+    try:
+        position = int(cursor)
+    except ValueError:
+        raise QueryError("Invalid cursor")
+    if position < 0:
+        raise QueryError("Invalid cursor")
+    return position
+
+
+def dumps(value: Any) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def loads(body: Union[bytes, memoryview]) -> Any:
+    if orjson is not None:
+        return orjson.loads(body)
+    if isinstance(body, memoryview):
+        body = body.tobytes()
+    return json.loads(body)
+
+
+def normalize_json(body: bytes) -> bytes:
+    """Re-encode a JSON document compactly (drops the upstream's indentation)."""
+    if orjson is None:
+        return body
+    return orjson.dumps(orjson.loads(body))
+
+
+def ndjson_lines(records: Iterable[bytes], batch_size: int = 256) -> Iterator[bytes]:
+    """Newline-delimits encoded records, yielding a few hundred lines per chunk."""
+    batch = []
+    for record in records:
+        batch.append(record)
+        if len(batch) == batch_size:
+            yield b"\n".join(batch) + b"\n"
+            batch = []
+    if batch:
+        yield b"\n".join(batch) + b"\n"
+
+
+def compute_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def parse_http_date(value: Optional[str]) -> Optional[float]:
+    if not value:
+        return None
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+
+def compress_variants(body: bytes, min_size: int = 1024, gzip_level: int = 6, brotli_quality: int = 9) -> dict:
+    """Builds the compressed encodings worth keeping for `body`, best first."""
+    if len(body) < min_size:
+        return {}
+    variants = {}
+    if brotli is not None:
+        variants["br"] = brotli.compress(body, quality=brotli_quality)
+    # mtime=0 keeps the gzip bytes (and so their ETag) stable across refreshes
+    variants["gzip"] = gzip.compress(body, compresslevel=gzip_level, mtime=0)
+    return {name: data for name, data in variants.items() if len(data) < len(body)}
+
+
+def parse_accept_encoding(header: Optional[str]) -> dict:
+    """Maps each coding in an Accept-Encoding header to its q-value."""
+    accepted = {}
+    for part in (header or "").split(","):
+        coding, _, params = part.strip().partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                q = float(params[2:])
+            except ValueError:
+                q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+class ResponseStats:
+    def __init__(self):
+        self.responses: dict[str, int] = {}
+        self.bytes_sent = 0
+        self.compression_bytes_saved = 0
+        self.not_modified = 0
+        self.not_modified_bytes_saved = 0
+
+    def record(self, encoding: str, sent: int, identity_size: int):
+        self.responses[encoding] = self.responses.get(encoding, 0) + 1
+        self.bytes_sent += sent
+        self.compression_bytes_saved += identity_size - sent
+
+    def record_not_modified(self, body_size: int):
+        self.not_modified += 1
+        self.not_modified_bytes_saved += body_size
+
+    def stats(self) -> dict:
+        return {
+            "responses_by_encoding": dict(self.responses),
+            "bytes_sent": self.bytes_sent,
+            "compression_bytes_saved": self.compression_bytes_saved,
+            "not_modified": self.not_modified,
+            "not_modified_bytes_saved": self.not_modified_bytes_saved,
+        }
+
+
+response_stats = ResponseStats()
+
+
+class Payload:
+    """One immutable version of an upstream document, ready to send."""
+
+    __slots__ = (
+        "body",
+        "etag",
+        "content_length",
+        "media_type",
+        "encodings",
+        "last_modified",
+        "upstream_etag",
+        "upstream_last_modified",
+        "derived",
+    )
+
+    def __init__(
+        self,
+        body: Union[bytes, memoryview],
+        media_type: str = JSON_MEDIA_TYPE,
+        encodings: Optional[dict] = None,
+        last_modified: Optional[float] = None,
+        upstream_etag: Optional[str] = None,
+        upstream_last_modified: Optional[str] = None,
+        etag: Optional[str] = None,
+    ):
+        # bytes, or a memoryview of a memory-mapped file (see diskcache.py)
+        self.body = body
+        # A known ETag saves hashing a body that was already hashed when stored
+        self.etag = etag or compute_etag(body)
+        self.content_length = len(body)
+        self.media_type = media_type
+        # Precompressed variants of `body`, keyed by content coding
+        self.encodings = encodings or {}
+        # Whole seconds, as HTTP dates cannot carry more precision
+        self.last_modified = int(last_modified if last_modified is not None else time.time())
+        # The upstream's own validators, sent back when revalidating this version
+        self.upstream_etag = upstream_etag
+        self.upstream_last_modified = upstream_last_modified
+        # Indexes and other structures built from this version, by name
+        self.derived: dict[str, Any] = {}
+
+    @classmethod
+    def from_upstream(
+        cls,
+        body: bytes,
+        normalize: bool = True,
+        compress: bool = True,
+        upstream_etag: Optional[str] = None,
+        upstream_last_modified: Optional[str] = None,
+        **compress_options,
+    ) -> "Payload":
+        if normalize:
+            body = normalize_json(body)
+        encodings = compress_variants(body, **compress_options) if compress else {}
+        return cls(
+            body,
+            encodings=encodings,
+            last_modified=parse_http_date(upstream_last_modified),
+            upstream_etag=upstream_etag,
+            upstream_last_modified=upstream_last_modified,
+        )
+
+    def derive(self, name: str, build: Callable[["Payload"], Any]) -> Any:
+        """Returns `build(self)`, computed once per payload version."""
+        value = self.derived.get(name)
+        if value is None:
+            value = self.derived[name] = build(self)
+        return value
+
+    @property
+    def size(self) -> int:
+        return self.content_length + sum(len(data) for data in self.encodings.values())
+
+    def select_encoding(self, accept_encoding: Optional[str]) -> str:
+        """Picks the stored variant the client prefers; "identity" if none."""
+        if not self.encodings:
+            return "identity"
+        accepted = parse_accept_encoding(accept_encoding)
+        wildcard = accepted.get("*", 0.0)
+        best, best_q = "identity", 0.0
+        # Variants are ordered best compression first, so ties keep the smaller one
+        for encoding in self.encodings:
+            q = accepted.get(encoding, wildcard)
+            if q > best_q:
+                best, best_q = encoding, q
+        return best
+
+    def etag_for(self, encoding: str) -> str:
+        # Each stored representation gets its own strong validator
+        if encoding == "identity":
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    def matches(self, if_none_match: str) -> bool:
+        """Weak comparison of an If-None-Match list against any of our representations."""
+        version = self.etag.strip('"')
+        for tag in if_none_match.split(","):
+            tag = tag.strip()
+            if tag == "*":
+                return True
+            if tag.startswith("W/"):
+                tag = tag[2:]
+            opaque = tag.strip('"')
+            if opaque == version or opaque.rsplit("-", 1)[0] == version:
+                return True
+        return False
+
+    def is_not_modified(self, request_headers: Mapping[str, str]) -> bool:
+        if_none_match = request_headers.get("if-none-match")
+        if if_none_match is not None:
+            # If-None-Match takes precedence over If-Modified-Since (RFC 9110 13.2.2)
+            return self.matches(if_none_match)
+        if_modified_since = parse_http_date(request_headers.get("if-modified-since"))
+        return if_modified_since is not None and self.last_modified <= if_modified_since
+
+    def to_response(self, request_headers: Optional[Mapping[str, str]] = None, headers: Optional[dict] = None) -> Response:
+        request_headers = request_headers or {}
+        encoding = self.select_encoding(request_headers.get("accept-encoding"))
+        body = self.body if encoding == "identity" else self.encodings[encoding]
+        response_headers = {
+            "ETag": self.etag_for(encoding),
+            "Last-Modified": formatdate(self.last_modified, usegmt=True),
+        }
+        if self.encodings:
+            response_headers["Vary"] = "Accept-Encoding"
+        if headers:
+            response_headers.update(headers)
+
+        if self.is_not_modified(request_headers):
+            response_stats.record_not_modified(len(body))
+            return Response(status_code=304, headers=response_headers)
+
+        response_headers["Content-Length"] = str(len(body))
+        if encoding != "identity":
+            response_headers["Content-Encoding"] = encoding
+        response_stats.record(encoding, len(body), self.content_length)
+        return Response(content=body, media_type=self.media_type, headers=response_headers)
@@ -0,0 +1,164 @@
+"""
+Columnar in-process store for the cached /photos dataset.
+
+The store is built once per cached payload version. Instead of keeping one
+dict per photo, numeric fields live in typed arrays and string fields in
+interned pools of pre-encoded JSON literals, so a page is filtered and
+serialized by concatenating bytes without materializing any row dicts.
+
+Rows are ordered by albumId so each album is one contiguous row range, and a
+page is a slice of that range rather than a scan over all photos.
+"""
+import sys
+from array import array
+from typing import Iterator, Optional, Sequence
+
+from payload import Payload, QueryError, dumps, loads, parse_cursor
+
+PHOTO_FIELDS = ("albumId", "id", "title", "url", "thumbnailUrl")
+NUMERIC_FIELDS = ("albumId", "id")
+STRING_FIELDS = ("title", "url", "thumbnailUrl")
+
+# Stored in the numeric columns for photos lacking the field; emitted as null
+MISSING = -(2**63)
+
+# `"name":` prefixes, encoded once
+FIELD_PREFIXES = {name: dumps(name) + b":" for name in PHOTO_FIELDS}
+
+
+def parse_fields(fields: Optional[str]) -> tuple[str, ...]:
+    """Parses a comma-separated `fields=` projection; empty means every field."""
+    if not fields:
+        return PHOTO_FIELDS
+    names = tuple(name.strip() for name in fields.split(",") if name.strip())
+    unknown = [name for name in names if name not in PHOTO_FIELDS]
+    if unknown:
+        raise QueryError(f"Unknown field(s): {', '.join(unknown)}")
+    return names
+
+
+def deep_sizeof(value, seen: Optional[set] = None) -> int:
+    """Approximate memory held by nested lists/dicts, counting shared objects once."""
+    seen = set() if seen is None else seen
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_sizeof(k, seen) + deep_sizeof(v, seen) for k, v in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(deep_sizeof(item, seen) for item in value)
+    return size
+
+
+class StringColumn:
+    """
+    Interned string pool: each distinct value is stored once as an encoded
+    JSON literal in `blob`, and rows refer to it by number.
+    """
+
+    def __init__(self, values: Sequence[Optional[str]]):
+        chunks = []
+        self.offsets = array("L", [0])
+        self.refs = array("L")
+        interned: dict[Optional[str], int] = {}
+        for value in values:
+            ref = interned.get(value)
+            if ref is None:
+                ref = interned[value] = len(chunks)
+                chunks.append(dumps(value))
+                self.offsets.append(self.offsets[-1] + len(chunks[-1]))
+            self.refs.append(ref)
+        self.blob = b"".join(chunks)
+
+    def encoded(self, row: int) -> bytes:
+        ref = self.refs[row]
+        return self.blob[self.offsets[ref]:self.offsets[ref + 1]]
+
+    @property
+    def distinct(self) -> int:
+        return len(self.offsets) - 1
+
+    @property
+    def nbytes(self) -> int:
+        return (
+            len(self.blob)
+            + self.offsets.itemsize * len(self.offsets)
+            + self.refs.itemsize * len(self.refs)
+        )
+
+
+class PhotoStore:
+    def __init__(self, rows: Sequence[dict]):
+        # Stable sort keeps the upstream order within an album
+        rows = sorted(rows, key=lambda row: row.get("albumId") or 0)
+        self.numeric = {
+            name: array("q", (MISSING if row.get(name) is None else row[name] for row in rows))
+            for name in NUMERIC_FIELDS
+        }
+        self.strings = {name: StringColumn([row.get(name) for row in rows]) for name in STRING_FIELDS}
+        self.album_ranges: dict[int, tuple[int, int]] = {}
+        for position, album_id in enumerate(self.numeric["albumId"]):
+            start, _ = self.album_ranges.get(album_id, (position, position))
+            self.album_ranges[album_id] = (start, position + 1)
+        self.row_dicts_bytes = deep_sizeof(rows)
+
+    @classmethod
+    def from_payload(cls, payload: Payload) -> "PhotoStore":
+        return cls(loads(payload.body))
+
+    def __len__(self) -> int:
+        return len(self.numeric["id"])
+
+    def encode_row(self, row: int, names: Sequence[str] = PHOTO_FIELDS) -> bytes:
+        parts = []
+        for name in names:
+            if name in self.strings:
+                value = self.strings[name].encoded(row)
+            else:
+                number = self.numeric[name][row]
+                value = b"null" if number == MISSING else str(number).encode()
+            parts.append(FIELD_PREFIXES[name] + value)
+        return b"{" + b",".join(parts) + b"}"
+
+    def select(
+        self, album_id: Optional[int] = None, limit: Optional[int] = None, cursor: Optional[str] = None
+    ) -> tuple[range, Optional[str]]:
+        """Returns the row positions of a page and the cursor of the next one, if any."""
+        if album_id is None:
+            start, end = 0, len(self)
+        else:
+            start, end = self.album_ranges.get(album_id, (0, 0))
+        start = max(start, parse_cursor(cursor))
+        stop = end if limit is None else min(end, start + limit)
+        next_cursor = str(stop) if stop < end else None
+        return range(start, max(start, stop)), next_cursor
+
+    def iter_rows(self, rows: range, names: Sequence[str] = PHOTO_FIELDS) -> Iterator[bytes]:
+        for row in rows:
+            yield self.encode_row(row, names)
+
+    def query(
+        self,
+        album_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+        fields: Optional[str] = None,
+    ) -> tuple[bytes, Optional[str]]:
+        """
+        Returns the serialized page and the cursor of the next page, if any.
+        """
+        names = parse_fields(fields)
+        rows, next_cursor = self.select(album_id, limit, cursor)
+        return b"[" + b",".join(self.iter_rows(rows, names)) + b"]", next_cursor
+
+    def memory_report(self) -> dict:
+        columnar = sum(column.itemsize * len(column) for column in self.numeric.values())
+        columnar += sum(column.nbytes for column in self.strings.values())
+        return {
+            "rows": len(self),
+            "columnar_bytes": columnar,
+            "row_dicts_bytes": self.row_dicts_bytes,
+            "saved_bytes": self.row_dicts_bytes - columnar,
+            "distinct_strings": {name: column.distinct for name, column in self.strings.items()},
+        }
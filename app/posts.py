@@ -0,0 +1,68 @@
+"""
+Hash indexes over the cached /posts dataset.
+
+Built once per cached payload version: every post is serialized once, and
+dictionaries map post id and userId to row positions, so filtered pages and
+single-post lookups are dictionary hits plus a byte join.
+"""
+from typing import Optional, Sequence
+
+from payload import Payload, dumps, loads, parse_cursor
+
+
+class PostIndex:
+    def __init__(self, posts: Sequence[dict]):
+        self.posts = list(posts)
+        self.encoded = [dumps(post) for post in self.posts]
+        self.by_id: dict[int, int] = {}
+        self.by_user: dict[int, list[int]] = {}
+        for position, post in enumerate(self.posts):
+            self.by_id[post.get("id")] = position
+            self.by_user.setdefault(post.get("userId"), []).append(position)
+
+    @classmethod
+    def from_payload(cls, payload: Payload) -> "PostIndex":
+        return cls(loads(payload.body))
+
+    def get(self, post_id: int) -> Optional[bytes]:
+        position = self.by_id.get(post_id)
+        return None if position is None else self.encoded[position]
+
+    def select(self, user_id: Optional[int] = None, post_id: Optional[int] = None) -> Sequence[int]:
+        """Row positions matching every given filter, in upstream order."""
+        if post_id is not None:
+            position = self.by_id.get(post_id)
+            if position is None or (user_id is not None and self.posts[position].get("userId") != user_id):
+                return []
+            return [position]
+        if user_id is not None:
+            return self.by_user.get(user_id, [])
+        return range(len(self.posts))
+
+    def page(
+        self,
+        user_id: Optional[int] = None,
+        post_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> tuple[Sequence[int], Optional[str]]:
+        """Returns the row positions of a page and the cursor of the next one, if any."""
+        positions = self.select(user_id, post_id)
+        start = parse_cursor(cursor)
+        stop = len(positions) if limit is None else min(len(positions), start + limit)
+        next_cursor = str(stop) if stop < len(positions) else None
+        return positions[start:stop], next_cursor
+
+    def query(
+        self,
+        user_id: Optional[int] = None,
+        post_id: Optional[int] = None,
+        limit: Optional[int] = None,
+        cursor: Optional[str] = None,
+    ) -> tuple[bytes, Optional[str]]:
+        """
+        Returns the serialized page and the cursor of the next page, if any.
+        """
+        positions, next_cursor = self.page(user_id, post_id, limit, cursor)
+        page = [self.encoded[position] for position in positions]
+        return b"[" + b",".join(page) + b"]", next_cursor
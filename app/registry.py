@@ -0,0 +1,82 @@
+"""
+Declarative registry of proxied upstream resources.
+
+Routes are read from a YAML file (proxy_routes.yaml next to this module by
+default, or the file named by PROXY_ROUTES_FILE) and mounted at startup.
+Every route gets the same machinery: the shared upstream client, the
+response cache, precompression, conditional requests and prefetching.
+"""
+import os
+from typing import Literal, Optional
+
+import yaml
+from pydantic import BaseModel, model_validator
+
+DEFAULT_ROUTES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "proxy_routes.yaml")
+
+
+class PostExpansion(BaseModel):
+    """Routes joined into each post by {path}/expanded, by route name."""
+
+    # Nested as the post's `comments`, matched on their postId
+    comments: str
+    # Nested as the post's `author`, matched on its userId
+    authors: str
+
+
+class ProxyRoute(BaseModel):
+    name: str
+    # Local path to mount the route at; None keeps it internal (e.g. for joins)
+    path: Optional[str] = None
+    upstream: str
+    # Singular noun used in error messages, e.g. "photo"
+    resource: str
+    auth: bool = True
+    ttl: float = 60.0
+    # Default to the global CACHE_* settings when not given
+    stale_while_revalidate: Optional[float] = None
+    stale_if_error: Optional[float] = None
+    deadline: float = 10.0
+    compress: bool = True
+    prefetch: bool = True
+    # Pipe the upstream body through as it arrives instead of caching it;
+    # streamed routes are never prefetched
+    stream: bool = False
+    # Query support built over the cached data: "photos" (albumId filter,
+    # cursor pagination, field projection) or "posts" (userId/id filters,
+    # /{id} lookup and /search)
+    index: Optional[Literal["photos", "posts"]] = None
+    # Also mount {path}/expanded, nesting related records from other routes
+    # into each post (posts index only)
+    expand: Optional[PostExpansion] = None
+    description: Optional[str] = None
+
+    @model_validator(mode="after")
+    def check_stream(self) -> "ProxyRoute":
+        if self.stream and self.index is not None:
+            raise ValueError(f"Streamed route {self.name} cannot be indexed, as it is not cached")
+        if self.expand is not None and self.index != "posts":
+            raise ValueError(f"Route {self.name} can only be expanded with the posts index")
+        return self
+
+
+class ProxyRegistry(BaseModel):
+    routes: list[ProxyRoute]
+
+
+def load_routes(path: Optional[str] = None) -> dict[str, ProxyRoute]:
+    """Loads and validates the route file, keyed by route name."""
+    path = path or os.getenv("PROXY_ROUTES_FILE") or DEFAULT_ROUTES_FILE
+    with open(path) as routes_file:
+        registry = ProxyRegistry.model_validate(yaml.safe_load(routes_file))
+    routes = {}
+    for route in registry.routes:
+        if route.name in routes:
+            raise ValueError(f"Duplicate proxy route name: {route.name}")
+        routes[route.name] = route
+    for route in routes.values():
+        if route.expand is not None:
+            for joined in (route.expand.comments, route.expand.authors):
+                if joined not in routes or routes[joined].stream:
+                    raise ValueError(f"Route {route.name} expands with {joined}, which is not a cached route")
+    return routes
@@ -0,0 +1,124 @@
+"""
+Background prefetching of upstream resources.
+
+Each registered resource is refreshed shortly before its cache TTL runs out,
+so requests keep hitting a warm cache instead of the first unlucky caller
+after expiry paying for the upstream round trip. Refreshes are jittered,
+run with bounded concurrency and back off exponentially while failing.
+"""
+import asyncio
+import random
+import time
+from typing import Awaitable, Callable, Optional
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class PrefetchSettings(BaseSettings):
+    """Scheduler tuning, overridable with PREFETCH_* env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="PREFETCH_")
+
+    enabled: bool = True
+    # Refresh after this fraction of the TTL has passed
+    refresh_ahead: float = 0.8
+    # Random +/- fraction applied to every delay, so workers do not sync up
+    jitter: float = 0.1
+    max_concurrency: int = 2
+    backoff_initial: float = 1.0
+    backoff_max: float = 300.0
+
+
+class PrefetchResource:
+    def __init__(self, name: str, refresh: Callable[[], Awaitable], ttl: float):
+        self.name = name
+        self.refresh = refresh
+        self.ttl = ttl
+        self.refreshes = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.last_refresh: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self.next_run: Optional[float] = None
+
+    def stats(self) -> dict:
+        return {
+            "ttl": self.ttl,
+            "refreshes": self.refreshes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "last_refresh": self.last_refresh,
+            "last_duration_ms": round(self.last_duration * 1000, 2) if self.last_duration is not None else None,
+            "last_error": self.last_error,
+            "next_run": self.next_run,
+        }
+
+
+class PrefetchScheduler:
+    def __init__(self, settings: PrefetchSettings):
+        self.settings = settings
+        self.resources: dict[str, PrefetchResource] = {}
+        self._tasks: list[asyncio.Task] = []
+        self._slots = asyncio.Semaphore(settings.max_concurrency)
+
+    def register(self, name: str, refresh: Callable[[], Awaitable], ttl: float):
+        self.resources[name] = PrefetchResource(name, refresh, ttl)
+
+    def refresh_window(self, ttl: float) -> float:
+        """
+        The most TTL a value can have left when its refresh comes due. A
+        refresh should not be satisfied by a shared version with less left.
+        """
+        return ttl * (1 - self.settings.refresh_ahead * (1 - self.settings.jitter))
+
+    def _jittered(self, delay: float) -> float:
+        return delay * random.uniform(1 - self.settings.jitter, 1 + self.settings.jitter)
+
+    def next_delay(self, resource: PrefetchResource) -> float:
+        if resource.consecutive_failures:
+            backoff = self.settings.backoff_initial * 2 ** (resource.consecutive_failures - 1)
+            return self._jittered(min(backoff, self.settings.backoff_max))
+        return self._jittered(resource.ttl * self.settings.refresh_ahead)
+
+    async def run_once(self, resource: PrefetchResource):
+        async with self._slots:
+            started = time.perf_counter()
+            try:
+                await resource.refresh()
+            except Exception as e:
+                resource.failures += 1
+                resource.consecutive_failures += 1
+                resource.last_error = f"{type(e).__name__}: {e}"
+            else:
+                resource.refreshes += 1
+                resource.consecutive_failures = 0
+                resource.last_error = None
+                resource.last_refresh = time.time()
+            resource.last_duration = time.perf_counter() - started
+
+    async def _run(self, resource: PrefetchResource):
+        # Warm the cache right away, then keep it warm
+        while True:
+            await self.run_once(resource)
+            delay = self.next_delay(resource)
+            resource.next_run = time.time() + delay
+            await asyncio.sleep(delay)
+
+    async def start(self):
+        if not self.settings.enabled or self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._run(resource)) for resource in self.resources.values()]
+
+    async def stop(self):
+        tasks, self._tasks = self._tasks, []
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.settings.enabled,
+            "running": bool(self._tasks),
+            "resources": {name: resource.stats() for name, resource in self.resources.items()},
+        }
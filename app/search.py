@@ -0,0 +1,115 @@
+"""
+Full-text search over cached documents.
+
+An inverted index (term -> {doc id: term frequency}) ranked with BM25. The
+index lives across cache refreshes and is updated incrementally: only
+documents that were added, removed or changed since the last version are
+re-tokenized.
+"""
+import hashlib
+import heapq
+import math
+import re
+import time
+from typing import Hashable, Mapping
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text: str) -> list[str]:
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class SearchIndex:
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.version = None
+        self.postings: dict[str, dict[Hashable, int]] = {}
+        self.doc_lengths: dict[Hashable, int] = {}
+        # Forward index (doc id -> its distinct terms) so a document can be removed
+        self.doc_terms: dict[Hashable, tuple[str, ...]] = {}
+        self.fingerprints: dict[Hashable, bytes] = {}
+        self.total_length = 0
+        self.last_update: dict = {}
+        self.queries = 0
+        self.query_seconds = 0.0
+
+    def _add(self, doc_id: Hashable, text: str):
+        tokens = tokenize(text)
+        frequencies: dict[str, int] = {}
+        for token in tokens:
+            frequencies[token] = frequencies.get(token, 0) + 1
+        for token, tf in frequencies.items():
+            self.postings.setdefault(token, {})[doc_id] = tf
+        self.doc_terms[doc_id] = tuple(frequencies)
+        self.doc_lengths[doc_id] = len(tokens)
+        self.total_length += len(tokens)
+
+    def _remove(self, doc_id: Hashable):
+        for token in self.doc_terms.pop(doc_id, ()):
+            postings = self.postings[token]
+            del postings[doc_id]
+            if not postings:
+                del self.postings[token]
+        self.total_length -= self.doc_lengths.pop(doc_id, 0)
+        self.fingerprints.pop(doc_id, None)
+
+    def update(self, documents: Mapping[Hashable, str], version=None):
+        """
+        Brings the index in line with `documents` (doc id -> text), touching
+        only the documents that changed since the last update.
+        """
+        added = removed = changed = 0
+        for doc_id in list(self.fingerprints):
+            if doc_id not in documents:
+                self._remove(doc_id)
+                removed += 1
+        for doc_id, text in documents.items():
+            fingerprint = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+            known = self.fingerprints.get(doc_id)
+            if known == fingerprint:
+                continue
+            if known is None:
+                added += 1
+            else:
+                self._remove(doc_id)
+                changed += 1
+            self._add(doc_id, text)
+            self.fingerprints[doc_id] = fingerprint
+        self.version = version
+        self.last_update = {
+            "added": added,
+            "removed": removed,
+            "changed": changed,
+            "unchanged": len(documents) - added - changed,
+        }
+
+    def search(self, query: str, k: int = 10) -> list[tuple[Hashable, float]]:
+        """Top-k (doc id, BM25 score) pairs, best first."""
+        started = time.perf_counter()
+        scores: dict[Hashable, float] = {}
+        n = len(self.doc_lengths)
+        if n:
+            average_length = self.total_length / n
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for doc_id, tf in postings.items():
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_id] / average_length)
+                    scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        results = heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+        self.queries += 1
+        self.query_seconds += time.perf_counter() - started
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "documents": len(self.doc_lengths),
+            "terms": len(self.postings),
+            "last_update": self.last_update,
+            "queries": self.queries,
+            "avg_query_ms": round(self.query_seconds / self.queries * 1000, 4) if self.queries else 0.0,
+        }
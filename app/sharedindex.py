@@ -0,0 +1,226 @@
+"""
+Cross-worker index of the shared cache tier, in a memory-mapped file.
+
+Every uvicorn worker on the host maps the same small file of fixed-size
+slots, one per cache key, recording which version of the key is current
+(its body digest, when it was fetched and its TTL) and which worker, if any,
+holds the lease to refresh it.
+
+Readers never lock: each slot carries a sequence number that writers make
+odd while they update the slot and even again afterwards (a seqlock), and a
+reader simply retries when it saw an odd number or the number changed under
+it. Writers serialize with an exclusive flock on the file, which is only
+taken when a version is published or a refresh lease changes hands.
+
+A writer killed between the two sequence updates would leave a slot odd for
+good. Since only the lock holder writes, an odd slot seen under the lock
+belongs to such a writer and is repaired; readers that keep finding a slot
+odd fall back to taking the lock themselves, so they never spin forever.
+
+Point CACHE_DISK_DIR at a tmpfs such as /dev/shm to keep both this index and
+the blobs it refers to purely in shared memory.
+"""
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+MAGIC = b"QHIDX001"
+HEADER = struct.Struct("<8sI4x")
+# seq, key hash, body digest, stored_at, ttl, lease_until, lease holder pid
+SLOT = struct.Struct("<Q16s16sdddi4x")
+SEQ = struct.Struct("<Q")
+EMPTY_KEY = bytes(16)
+# Reads of a slot mid-update before a reader takes the lock instead
+SPIN_LIMIT = 1000
+
+
+def key_hash(key: str) -> bytes:
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+
+
+class SlotState:
+    __slots__ = ("digest", "stored_at", "ttl", "lease_until", "lease_pid")
+
+    def __init__(self, digest: str, stored_at: float, ttl: float, lease_until: float, lease_pid: int):
+        self.digest = digest
+        self.stored_at = stored_at
+        self.ttl = ttl
+        self.lease_until = lease_until
+        self.lease_pid = lease_pid
+
+    @property
+    def etag(self) -> Optional[str]:
+        return '"' + self.digest + '"' if self.digest else None
+
+    def remaining_ttl(self, now: Optional[float] = None) -> float:
+        return self.stored_at + self.ttl - (time.time() if now is None else now)
+
+    def leased(self, now: Optional[float] = None) -> bool:
+        return self.lease_until > (time.time() if now is None else now)
+
+
+class SharedIndex:
+    def __init__(self, path: str, slots: int = 256):
+        self.path = path
+        # flock does not exclude other threads of this process (they share the
+        # file descriptor), so they also take a thread lock first
+        self._thread_lock = threading.Lock()
+        self._lock_owner: Optional[int] = None
+        size = HEADER.size + SLOT.size * slots
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        with self._locked():
+            if os.fstat(self._fd).st_size < HEADER.size:
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, slots), 0)
+            magic, self.slots = HEADER.unpack(os.pread(self._fd, HEADER.size, 0))
+            if magic != MAGIC:
+                raise ValueError(f"{path} is not a shared cache index")
+        self._map = mmap.mmap(self._fd, HEADER.size + SLOT.size * self.slots)
+        self.retries = 0
+        self.repairs = 0
+        self.leases_granted = 0
+        self.leases_denied = 0
+        self.publishes = 0
+
+    def close(self):
+        self._map.close()
+        os.close(self._fd)
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        with self._thread_lock:
+            fcntl.flock(self._fd, fcntl.LOCK_EX)
+            self._lock_owner = threading.get_ident()
+            try:
+                yield
+            finally:
+                self._lock_owner = None
+                fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def _holding_lock(self) -> bool:
+        return self._lock_owner == threading.get_ident()
+
+    def _offset(self, slot: int) -> int:
+        return HEADER.size + slot * SLOT.size
+
+    def _read_slot(self, slot: int) -> tuple:
+        """A consistent copy of a slot, retrying while a writer is mid-update."""
+        offset = self._offset(slot)
+        for _ in range(SPIN_LIMIT):
+            before = SEQ.unpack_from(self._map, offset)[0]
+            if before % 2 == 0:
+                fields = SLOT.unpack_from(self._map, offset)
+                if SEQ.unpack_from(self._map, offset)[0] == before:
+                    return fields
+            elif self._holding_lock():
+                # No other writer can be active, so this one died mid-update
+                self._repair(slot)
+                continue
+            self.retries += 1
+        # Either a long write or a dead writer: waiting for the lock settles which
+        with self._locked():
+            return self._read_slot(slot)
+
+    def _repair(self, slot: int):
+        # The fields are packed in a single copy, so they hold either the old or
+        # the new version; only the dead writer's lease has to go
+        offset = self._offset(slot)
+        seq, hashed, digest, stored_at, ttl, _, _ = SLOT.unpack_from(self._map, offset)
+        SLOT.pack_into(self._map, offset, seq + 1, hashed, digest, stored_at, ttl, 0.0, 0)
+        self.repairs += 1
+
+    def _find(self, hashed: bytes, claim: bool = False) -> Optional[int]:
+        """The slot holding `hashed`, by linear probing; with `claim`, an empty one otherwise."""
+        start = int.from_bytes(hashed[:8], "little") % self.slots
+        for probe in range(self.slots):
+            slot = (start + probe) % self.slots
+            stored_key = self._read_slot(slot)[1]
+            if stored_key == hashed:
+                return slot
+            if stored_key == EMPTY_KEY:
+                return slot if claim else None
+        return None
+
+    def _write_slot(self, slot: int, hashed: bytes, digest: str, stored_at: float, ttl: float, lease_until: float, pid: int):
+        # Callers hold the file lock, so there is a single writer
+        offset = self._offset(slot)
+        seq = SEQ.unpack_from(self._map, offset)[0]
+        if seq % 2:
+            self._repair(slot)
+            seq += 1
+        SEQ.pack_into(self._map, offset, seq + 1)
+        SLOT.pack_into(
+            self._map, offset, seq + 1, hashed, bytes.fromhex(digest) if digest else bytes(16), stored_at, ttl, lease_until, pid
+        )
+        SEQ.pack_into(self._map, offset, seq + 2)
+
+    def read(self, key: str) -> Optional[SlotState]:
+        """The current version of `key` as published by any worker; None if unknown."""
+        slot = self._find(key_hash(key))
+        if slot is None:
+            return None
+        _, _, digest, stored_at, ttl, lease_until, pid = self._read_slot(slot)
+        return SlotState(digest.hex() if digest != bytes(16) else "", stored_at, ttl, lease_until, pid)
+
+    def publish(self, key: str, digest: str, stored_at: float, ttl: float):
+        """Makes `digest` the current version of `key`, ending any refresh lease."""
+        hashed = key_hash(key)
+        with self._locked():
+            slot = self._find(hashed, claim=True)
+            if slot is None:
+                return
+            self._write_slot(slot, hashed, digest, stored_at, ttl, 0.0, 0)
+        self.publishes += 1
+
+    def try_lease(self, key: str, seconds: float) -> bool:
+        """
+        Claims the right to refresh `key` for `seconds`. Fails while any
+        unexpired lease is held, this process's own included, so there is
+        exactly one refresher; a full index grants every lease.
+        """
+        hashed = key_hash(key)
+        now = time.time()
+        pid = os.getpid()
+        with self._locked():
+            slot = self._find(hashed, claim=True)
+            if slot is None:
+                return True
+            _, _, digest, stored_at, ttl, lease_until, _ = self._read_slot(slot)
+            if lease_until > now:
+                self.leases_denied += 1
+                return False
+            digest_hex = digest.hex() if digest != bytes(16) else ""
+            self._write_slot(slot, hashed, digest_hex, stored_at, ttl, now + seconds, pid)
+        self.leases_granted += 1
+        return True
+
+    def release(self, key: str):
+        """Gives up this process's lease on `key` without publishing a version."""
+        hashed = key_hash(key)
+        with self._locked():
+            slot = self._find(hashed)
+            if slot is None:
+                return
+            _, _, digest, stored_at, ttl, lease_until, holder = self._read_slot(slot)
+            if holder == os.getpid() and lease_until:
+                digest_hex = digest.hex() if digest != bytes(16) else ""
+                self._write_slot(slot, hashed, digest_hex, stored_at, ttl, 0.0, 0)
+
+    def stats(self) -> dict:
+        used = sum(1 for slot in range(self.slots) if self._read_slot(slot)[1] != EMPTY_KEY)
+        return {
+            "path": self.path,
+            "slots": self.slots,
+            "used": used,
+            "read_retries": self.retries,
+            "repairs": self.repairs,
+            "publishes": self.publishes,
+            "leases_granted": self.leases_granted,
+            "leases_denied": self.leases_denied,
+        }
@@ -0,0 +1,90 @@
+import json
+import sys
+
+import pytest
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.exception_handlers import http_exception_handler
+from fastapi.responses import PlainTextResponse, StreamingResponse
+
+import batch
+from batch import BatchRequest, SubResponse, encode_result, run_batch
+
+app = FastAPI()
+
+
+@app.get("/json")
+async def json_endpoint(request: Request):
+    return {"user": request.state.user, "q": request.query_params.get("q")}
+
+
+@app.get("/text")
+async def text_endpoint():
+    return PlainTextResponse("hello")
+
+
+@app.get("/stream")
+async def stream_endpoint():
+    async def chunks():
+        yield b"a"
+        yield b"b"
+
+    return StreamingResponse(chunks(), media_type="text/plain")
+
+
+@app.get("/crash")
+async def crash_endpoint():
+    return {}["secret"]
+
+
+@app.get("/fail")
+async def fail_endpoint():
+    raise HTTPException(status_code=418, detail="teapot")
+
+
+async def collect(batch: BatchRequest, max_concurrency: int = 2) -> dict:
+    parent = {
+        "type": "http",
+        "asgi": {"version": "3.0"},
+        "http_version": "1.1",
+        "scheme": "http",
+        "app": app,
+        # Installed by the app's exception middleware on the /batch request
+        "starlette.exception_handlers": ({HTTPException: http_exception_handler}, {}),
+    }
+    lines = [
+        json.loads(line)
+        async for line in run_batch(app.router, parent, batch, None, {"user": "alice"}, max_concurrency)
+    ]
+    return {line["id"]: line for line in lines}
+
+
+def test_json_bodies_are_embedded_raw():
+    line = encode_result("a", SubResponse(200, [(b"content-type", b"application/json")], b'{"x":1}'), 0.0015)
+    assert json.loads(line) == {"id": "a", "status": 200, "duration_ms": 1.5, "body": {"x": 1}}
+    assert line.endswith(b"\n")
+
+
+@pytest.mark.asyncio
+async def test_subrequests_are_dispatched_in_process():
+    results = await collect(BatchRequest(requests=[
+        {"id": "json", "path": "/json?q=1"},
+        {"id": "text", "path": "/text"},
+        {"id": "stream", "path": "/stream"},
+        {"id": "fail", "path": "/fail"},
+        {"path": "/nowhere"},
+    ]))
+    assert results["json"]["body"] == {"user": "alice", "q": "1"}
+    assert results["text"]["body"] == "hello"
+    assert results["stream"]["body"] == "ab"
+    assert results["fail"] == {**results["fail"], "status": 418, "body": {"detail": "teapot"}}
+    assert results[4]["status"] == 404
+
+
+@pytest.mark.asyncio
+async def test_unhandled_errors_are_logged_but_not_exposed(monkeypatch):
+    logged = []
+    monkeypatch.setattr(batch.logger, "exception", lambda message: logged.append((message, sys.exc_info()[0])))
+    results = await collect(BatchRequest(requests=[{"id": "crash", "path": "/crash"}]))
+    assert results["crash"]["status"] == 500
+    assert results["crash"]["body"] == {"detail": "Internal Server Error"}
+    assert logged == [("Batch sub-request /crash failed", KeyError)]
@@ -0,0 +1,115 @@
+import asyncio
+
+import httpx
+import pytest
+
+from cache import ResponseCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def counting_loader(values):
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        value = values[len(calls) - 1]
+        if isinstance(value, Exception):
+            raise value
+        return value, 10
+
+    return loader, calls
+
+
+@pytest.mark.asyncio
+async def test_fresh_entries_are_served_without_loading():
+    cache = ResponseCache(max_entries=10, max_bytes=1000, clock=FakeClock())
+    loader, calls = counting_loader(["a"])
+    assert await cache.get_or_load("k", loader, ttl=60) == "a"
+    assert await cache.get_or_load("k", loader, ttl=60) == "a"
+    assert len(calls) == 1
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_while_revalidate_refreshes_in_background():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, max_bytes=1000, clock=clock)
+    loader, calls = counting_loader(["old", "new"])
+    await cache.get_or_load("k", loader, ttl=60, stale_while_revalidate=30)
+
+    clock.now += 70
+    assert await cache.get_or_load("k", loader, ttl=60, stale_while_revalidate=30) == "old"
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert await cache.get_or_load("k", loader, ttl=60, stale_while_revalidate=30) == "new"
+    assert cache.stats()["refreshes"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stale_if_error_serves_old_value_on_network_error():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, max_bytes=1000, clock=clock)
+    loader, _ = counting_loader(["old", httpx.ConnectError("down"), httpx.ConnectError("down")])
+    await cache.get_or_load("k", loader, ttl=60)
+
+    clock.now += 100
+    assert await cache.get_or_load("k", loader, ttl=60, stale_if_error=300) == "old"
+    assert cache.stats()["stale_if_error_hits"] == 1
+
+    clock.now += 1000
+    with pytest.raises(httpx.RequestError):
+        await cache.get_or_load("k", loader, ttl=60, stale_if_error=300)
+
+
+@pytest.mark.asyncio
+async def test_least_recently_used_entries_are_evicted():
+    cache = ResponseCache(max_entries=10, max_bytes=25, clock=FakeClock())
+    for key in ("a", "b"):
+        loader, _ = counting_loader([key])
+        await cache.get_or_load(key, loader, ttl=60)
+    # Touch "a" so that "b" becomes the eviction candidate
+    await cache.get_or_load("a", loader, ttl=60)
+    loader, _ = counting_loader(["c"])
+    await cache.get_or_load("c", loader, ttl=60)
+
+    assert cache.get_entry("a") is not None
+    assert cache.get_entry("b") is None
+    assert cache.stats()["evictions"] == 1
+    assert cache.total_bytes == 20
+
+
+@pytest.mark.asyncio
+async def test_loader_can_override_ttl():
+    clock = FakeClock()
+    cache = ResponseCache(max_entries=10, max_bytes=1000, clock=clock)
+
+    async def loader():
+        return "aged", 10, 5.0
+
+    await cache.get_or_load("k", loader, ttl=60)
+    assert cache.get_entry("k").expires_at == clock.now + 5.0
+    cache.put("stale", "v", 10, ttl=-1)
+    assert cache.get_entry("stale").expires_at < clock.now
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = ResponseCache(max_entries=10, max_bytes=1000, clock=FakeClock())
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return object(), 10
+
+    values = await asyncio.gather(*(cache.get_or_load("k", loader, ttl=60) for _ in range(20)))
+    assert len(calls) == 1
+    assert all(value is values[0] for value in values)
+    assert cache.stats()["loads_coalesced"] == 19
@@ -0,0 +1,77 @@
+import os
+import time
+
+from diskcache import DiskCache
+from payload import Payload
+
+BODY = b'[{"id":1,"title":"' + b"x" * 4000 + b'"}]'
+
+
+def make_payload():
+    return Payload.from_upstream(BODY, upstream_etag='"up"', upstream_last_modified="Wed, 21 Oct 2015 07:28:00 GMT")
+
+
+def test_round_trip_is_memory_mapped(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    payload = make_payload()
+    disk.save("https://example.test/items", payload, ttl=60)
+
+    stored = disk.load("https://example.test/items")
+    assert isinstance(stored.payload.body, memoryview)
+    assert bytes(stored.payload.body) == payload.body
+    assert stored.payload.etag == payload.etag
+    assert bytes(stored.payload.encodings["gzip"]) == payload.encodings["gzip"]
+    assert stored.payload.upstream_etag == '"up"'
+    assert stored.payload.last_modified == payload.last_modified
+    assert 59 < stored.remaining_ttl() <= 60
+    assert disk.load("https://example.test/other") is None
+
+
+def test_blobs_are_content_addressed_and_deduplicated(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.save("a", make_payload(), ttl=60)
+    disk.save("b", make_payload(), ttl=60)
+    assert disk.blob_writes == 2  # identity + gzip, written once
+    assert disk.blobs_deduplicated == 2
+    assert sorted(disk.keys()) == ["a", "b"]
+    assert not [name for name in os.listdir(disk.blob_dir) if name.startswith(".tmp-")]
+
+
+def test_prune_removes_only_unreferenced_blobs(tmp_path):
+    disk = DiskCache(str(tmp_path), blob_grace=0.0)
+    disk.save("a", make_payload(), ttl=60)
+    disk.save("a", Payload.from_upstream(b"[]"), ttl=60)
+    time.sleep(0.01)
+    disk.prune()
+    assert disk.blobs_pruned == 2
+    assert bytes(disk.load("a").payload.body) == b"[]"
+
+
+def test_saving_a_new_version_prunes_the_old_one(tmp_path):
+    disk = DiskCache(str(tmp_path), blob_grace=0.05)
+    disk.save("a", make_payload(), ttl=60)
+    # Within the grace window a replaced blob may still be another worker's
+    disk.save("a", Payload.from_upstream(b"[1]"), ttl=60)
+    assert disk.blobs_pruned == 0
+    time.sleep(0.1)
+    disk.save("a", Payload.from_upstream(b"[]"), ttl=60)
+    assert disk.blobs_pruned == 3
+    assert os.listdir(disk.blob_dir) == [disk.load("a").payload.etag.strip('"')]
+    # Saving the same version again leaves the directory alone
+    disk.save("a", Payload.from_upstream(b"[]"), ttl=60)
+    assert disk.blobs_pruned == 3
+
+
+def test_stale_entries_report_negative_ttl(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    disk.save("a", make_payload(), ttl=60, stored_at=time.time() - 100)
+    assert disk.load("a").remaining_ttl() < -39
+
+
+def test_missing_blob_is_a_miss(tmp_path):
+    disk = DiskCache(str(tmp_path))
+    payload = make_payload()
+    disk.save("a", payload, ttl=60)
+    os.unlink(os.path.join(disk.blob_dir, payload.etag.strip('"')))
+    assert disk.load("a") is None
+    assert disk.read_misses == 1
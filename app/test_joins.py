@@ -0,0 +1,32 @@
+import json
+
+from joins import KeyIndex, expand_posts, extend_object
+from posts import PostIndex
+
+POSTS = [{"userId": 1 + i // 2, "id": i + 1, "title": f"title {i + 1}"} for i in range(4)]
+COMMENTS = [{"postId": 1 + i % 3, "id": i + 1, "body": f"comment {i + 1}"} for i in range(5)]
+USERS = [{"id": 1, "name": "Leanne"}]
+
+
+def test_key_index_groups_records():
+    comments = KeyIndex(COMMENTS, "postId")
+    assert [json.loads(c)["id"] for c in comments.all(1)] == [1, 4]
+    assert comments.all(99) == []
+    assert len(comments) == 5
+    assert json.loads(KeyIndex(USERS, "id").first(1)) == USERS[0]
+
+
+def test_extend_object():
+    assert json.loads(extend_object(b'{"a":1}', [("b", b"[]")])) == {"a": 1, "b": []}
+    assert json.loads(extend_object(b"{}", [("b", b"null")])) == {"b": None}
+
+
+def test_expand_posts_nests_comments_and_author():
+    index = PostIndex(POSTS)
+    positions, _ = index.page(limit=4)
+    expanded = json.loads(expand_posts(index.posts, index.encoded, positions, KeyIndex(COMMENTS, "postId"), KeyIndex(USERS, "id")))
+    assert [c["id"] for c in expanded[0]["comments"]] == [1, 4]
+    assert expanded[3]["comments"] == []
+    assert expanded[0]["author"] == USERS[0]
+    assert expanded[2]["author"] is None
+    assert expanded[0]["title"] == "title 1"
@@ -1,7 +1,17 @@
+import json
+import os
+import time
 import pytest
 from fastapi.testclient import TestClient
 import httpx # Keep httpx import for Response/RequestError objects if needed for mocking
-from main import app, fake_users_db, pwd_context, create_access_token, ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
+
+# Keep the background prefetcher from calling the real upstream during tests
+os.environ.setdefault("PREFETCH_ENABLED", "false")
+# A fixed, cheap bcrypt cost instead of calibrating one at startup
+os.environ.setdefault("PASSWORD_ROUNDS", "5")
+
+
+from main import app, fake_users_db, mount_proxy_route, ProxyRoute, pwd_context, create_access_token, upstream, response_cache, cache_settings, ACCESS_TOKEN_EXPIRE_MINUTES, ALGORITHM, SECRET_KEY
 from datetime import timedelta, datetime, timezone
 from jose import jwt
 import respx # Import respx for mocking external HTTP calls
@@ -19,6 +29,13 @@ sync_client = TestClient(app) # This client handles both sync and async endpoint
 
 # --- Fixtures ---
 
+# Run the app lifespan (shared upstream client etc.) for the whole session
+@pytest.fixture(scope="session", autouse=True)
+def app_lifespan():
+    with sync_client:
+        yield
+
+
 # Fixture to clear the fake database before each test
 @pytest.fixture(autouse=True)
 def clear_db():
@@ -27,6 +44,14 @@ def clear_db():
     fake_users_db.clear()
 
 
+# Fixture to start every test with a cold response cache
+@pytest.fixture(autouse=True)
+def clear_response_cache():
+    response_cache.clear()
+    yield
+    response_cache.clear()
+
+
 # Helper fixture to get authentication headers for tests
 @pytest.fixture
 def auth_headers():
@@ -124,6 +149,39 @@ def test_login_for_access_token_invalid_credentials():
     assert response.status_code == 401
     assert response.json() == {"detail": "Incorrect username or password"}
 
+def test_login_is_refused_with_503_when_password_pool_is_full(monkeypatch):
+    import main
+    fake_users_db["busyuser"] = {"username": "busyuser", "hashed_password": pwd_context.hash("pw"), "disabled": False}
+    monkeypatch.setattr(main.password_pool, "max_queue", 0)
+    response = sync_client.post("/token", json={"username": "busyuser", "password": "pw"})
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == "1"
+
+def test_login_rehashes_a_password_stored_at_an_outdated_cost():
+    import main
+    from passlib.hash import bcrypt
+    outdated = bcrypt.using(rounds=4).hash("password123")
+    fake_users_db["olduser"] = {"username": "olduser", "hashed_password": outdated, "disabled": False}
+    rehashes = main.password_cost.rehashes
+    response = sync_client.post("/token", json={"username": "olduser", "password": "password123"})
+    assert response.status_code == 200
+    upgraded = fake_users_db["olduser"]["hashed_password"]
+    assert upgraded != outdated
+    assert bcrypt.from_string(upgraded).rounds == 5
+    assert not pwd_context.needs_update(upgraded)
+    assert pwd_context.verify("password123", upgraded)
+    cost = sync_client.get("/metrics").json()["password_cost"]
+    assert cost["rounds"] == 5
+    assert cost["source"] == "configured"
+    assert cost["rehashes"] == rehashes + 1
+
+def test_login_keeps_a_current_hash():
+    hashed_password = pwd_context.hash("password123")
+    fake_users_db["newuser"] = {"username": "newuser", "hashed_password": hashed_password, "disabled": False}
+    response = sync_client.post("/token", json={"username": "newuser", "password": "password123"})
+    assert response.status_code == 200
+    assert fake_users_db["newuser"]["hashed_password"] == hashed_password
+
 def test_login_for_access_token_non_existent_user():
     response = sync_client.post(
         "/token",
@@ -150,6 +208,49 @@ def test_read_users_me_invalid_token():
     assert response.status_code == 401
     assert response.json() == {"detail": "Could not validate credentials"}
 
+def test_bearer_scheme_is_case_insensitive(auth_headers):
+    token = auth_headers["Authorization"].split(" ", 1)[1]
+    response = sync_client.get("/users/me/", headers={"Authorization": f"bearer {token}"})
+    assert response.status_code == 200
+    assert response.json()["username"] == "testuser_auth"
+
+def test_token_is_decoded_once_per_request(auth_headers, monkeypatch):
+    import main
+    decoded = []
+    real_decode = main.jwt.decode
+
+    def counting_decode(*args, **kwargs):
+        decoded.append(1)
+        return real_decode(*args, **kwargs)
+
+    monkeypatch.setattr(main.jwt, "decode", counting_decode)
+    records = []
+    monkeypatch.setattr(main.logger, "info", lambda message, extra: records.append(extra))
+    main.token_cache.clear()
+    response = sync_client.get("/users/me/", headers=auth_headers)
+    assert response.status_code == 200
+    assert len(decoded) == 1
+    assert records[-1]["user"] == "testuser_auth"
+
+    # Later requests with the same token are served from the verified-token cache
+    hits = main.token_cache.hits
+    assert sync_client.get("/users/me/", headers=auth_headers).status_code == 200
+    assert len(decoded) == 1
+    assert main.token_cache.hits == hits + 1
+
+    # A revoked token is refused even though its signature still verifies
+    main.revoke_user_tokens("testuser_auth")
+    assert sync_client.get("/users/me/", headers=auth_headers).status_code == 401
+    assert sync_client.get("/users/me/", headers=auth_headers).status_code == 401
+    assert len(decoded) == 3
+    assert main.token_cache.invalidations >= 1
+
+    # Logging in again issues a token that works
+    fake_users_db["testuser_auth"]["hashed_password"] = pwd_context.hash("authpassword")
+    login = sync_client.post("/token", json={"username": "testuser_auth", "password": "authpassword"})
+    fresh_headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    assert sync_client.get("/users/me/", headers=fresh_headers).status_code == 200
+
 def test_read_users_me_disabled_user(disabled_auth_headers):
     response = sync_client.get("/users/me/", headers=disabled_auth_headers)
     assert response.status_code == 400
@@ -203,3 +304,361 @@ async def test_get_posts_network_error_external_api(auth_headers):
     assert response.status_code == 503
     assert response.json() == {"detail": "Could not connect to external post API"}
     assert respx.calls.call_count == 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_upstream_client_is_shared_between_requests(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(200, json=[])
+    respx.get("https://jsonplaceholder.typicode.com/posts").return_value = httpx.Response(200, json=[])
+    client_before = upstream.client
+    sync_client.get("/photos", headers=auth_headers)
+    sync_client.get("/posts", headers=auth_headers)
+    assert upstream.client is client_before
+    assert upstream.clients_created == 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_photos_served_from_cache(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(
+        200, json=[{"id": 1, "title": "photo1"}]
+    )
+    first = sync_client.get("/photos", headers=auth_headers)
+    second = sync_client.get("/photos", headers=auth_headers)
+
+    assert first.json() == second.json() == [{"id": 1, "title": "photo1"}]
+    assert respx.calls.call_count == 1
+    assert first.headers["etag"] == second.headers["etag"]
+    assert sync_client.get("/metrics").json()["cache"]["hits"] >= 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_photos_served_precompressed(auth_headers):
+    photos = [{"id": i, "title": f"photo{i}", "url": f"url{i}"} for i in range(100)]
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(200, json=photos)
+    response = sync_client.get("/photos", headers={**auth_headers, "Accept-Encoding": "gzip"})
+
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    assert response.headers["vary"] == "Accept-Encoding"
+    assert response.json() == photos
+    assert sync_client.get("/metrics").json()["responses"]["compression_bytes_saved"] > 0
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_posts_revalidated_with_etag_returns_304(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/posts").return_value = httpx.Response(
+        200, json=[{"id": 1, "title": "post1"}]
+    )
+    first = sync_client.get("/posts", headers=auth_headers)
+    second = sync_client.get("/posts", headers={**auth_headers, "If-None-Match": first.headers["etag"]})
+
+    assert first.status_code == 200
+    assert second.status_code == 304
+    assert second.content == b""
+    assert second.headers["etag"] == first.headers["etag"]
+    assert second.headers["last-modified"] == first.headers["last-modified"]
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_expired_cache_is_revalidated_conditionally(auth_headers):
+    url = "https://jsonplaceholder.typicode.com/posts"
+    route = respx.get(url)
+    route.side_effect = [
+        httpx.Response(200, json=[{"id": 1}], headers={"ETag": 'W/"v1"'}),
+        httpx.Response(304),
+    ]
+    first = sync_client.get("/posts", headers=auth_headers)
+    response_cache.get_entry(url).expires_at = float("-inf")
+    revalidations_before = upstream.revalidation_hits
+    second = sync_client.get("/posts", headers=auth_headers)
+
+    assert second.status_code == 200
+    assert second.json() == [{"id": 1}]
+    assert second.headers["etag"] == first.headers["etag"]
+    assert route.calls[1].request.headers["if-none-match"] == 'W/"v1"'
+    assert upstream.revalidation_hits == revalidations_before + 1
+    assert response_cache.get_entry(url).expires_at > 0
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_photos_filtered_paginated_and_projected(auth_headers):
+    photos = [{"albumId": 1 + i // 3, "id": i, "title": f"t{i}", "url": f"u{i}", "thumbnailUrl": f"th{i}"} for i in range(9)]
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(200, json=photos)
+
+    response = sync_client.get("/photos?albumId=2&limit=2&fields=id,thumbnailUrl", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == [{"id": 3, "thumbnailUrl": "th3"}, {"id": 4, "thumbnailUrl": "th4"}]
+
+    cursor = response.headers["x-next-cursor"]
+    response = sync_client.get(f"/photos?albumId=2&limit=2&fields=id&cursor={cursor}", headers=auth_headers)
+    assert response.json() == [{"id": 5}]
+    assert "x-next-cursor" not in response.headers
+    assert respx.calls.call_count == 1
+    assert sync_client.get("/metrics").json()["photo_store"]["rows"] == 9
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_photos_rejects_unknown_field(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(200, json=[])
+    response = sync_client.get("/photos?fields=password", headers=auth_headers)
+    assert response.status_code == 400
+    assert response.json() == {"detail": "Unknown field(s): password"}
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_posts_filtered_by_user_and_single_post_lookup(auth_headers):
+    posts = [{"userId": 1 + i // 2, "id": i + 1, "title": f"p{i + 1}", "body": "b"} for i in range(6)]
+    respx.get("https://jsonplaceholder.typicode.com/posts").return_value = httpx.Response(200, json=posts)
+
+    response = sync_client.get("/posts?userId=2", headers=auth_headers)
+    assert response.status_code == 200
+    assert [post["id"] for post in response.json()] == [3, 4]
+
+    response = sync_client.get("/posts/5", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == posts[4]
+
+    response = sync_client.get("/posts/99", headers=auth_headers)
+    assert response.status_code == 404
+    assert response.json() == {"detail": "Post not found"}
+    assert respx.calls.call_count == 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_search_posts_returns_ranked_matches(auth_headers):
+    posts = [
+        {"userId": 1, "id": 1, "title": "caching strategies", "body": "stale while revalidate caching"},
+        {"userId": 1, "id": 2, "title": "unrelated", "body": "nothing to see"},
+        {"userId": 2, "id": 3, "title": "misc", "body": "a note on caching"},
+    ]
+    respx.get("https://jsonplaceholder.typicode.com/posts").return_value = httpx.Response(200, json=posts)
+
+    response = sync_client.get("/posts/search?q=caching", headers=auth_headers)
+    assert response.status_code == 200
+    results = response.json()
+    assert [post["id"] for post in results] == [1, 3]
+    assert results[0]["title"] == "caching strategies"
+    assert results[0]["score"] > results[1]["score"]
+
+@pytest.mark.asyncio
+async def test_open_circuit_serves_stale_data_then_503(auth_headers, monkeypatch):
+    url = "https://jsonplaceholder.typicode.com/posts"
+    with respx.mock:
+        respx.get(url).return_value = httpx.Response(200, json=[{"id": 1}])
+        sync_client.get("/posts", headers=auth_headers)
+
+    breaker = upstream.breaker_for("jsonplaceholder.typicode.com")
+    monkeypatch.setattr(breaker, "allow", lambda: False)
+    # Past the stale-while-revalidate window, so only stale-if-error can answer
+    response_cache.get_entry(url).expires_at = response_cache.clock() - cache_settings.stale_while_revalidate - 1
+    stale = sync_client.get("/posts", headers=auth_headers)
+    assert stale.status_code == 200
+    assert stale.json() == [{"id": 1}]
+
+    response_cache.clear()
+    response = sync_client.get("/posts", headers=auth_headers)
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Could not connect to external post API"}
+
+def test_metrics_reports_upstream_pool():
+    response = sync_client.get("/metrics")
+    assert response.status_code == 200
+    pool = response.json()["upstream"]["connections"]
+    assert pool["max"] == upstream.settings.max_connections
+    assert 0 <= pool["utilization"] <= 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_registry_routes_are_proxied_with_auth(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/comments").return_value = httpx.Response(
+        200, json=[{"postId": 1, "id": 1, "body": "comment1"}]
+    )
+    assert sync_client.get("/comments").status_code == 401
+    response = sync_client.get("/comments", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json() == [{"postId": 1, "id": 1, "body": "comment1"}]
+    assert "etag" in response.headers
+    sync_client.get("/comments", headers=auth_headers)
+    assert respx.calls.call_count == 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_batch_resolves_subrequests_concurrently(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(
+        200, json=[{"albumId": 1, "id": 1, "title": "photo1", "url": "url1", "thumbnailUrl": "thumb1"}]
+    )
+    respx.get("https://jsonplaceholder.typicode.com/posts").return_value = httpx.Response(
+        200, json=[{"userId": 1, "id": 1, "title": "t", "body": "b"}]
+    )
+    response = sync_client.post("/batch", headers=auth_headers, json={"requests": [
+        {"id": "photos", "path": "/photos?albumId=1&fields=id"},
+        {"id": "post", "path": "/posts/1"},
+        {"id": "me", "path": "/users/me/"},
+        {"id": "missing", "path": "/posts/99"},
+    ]})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("application/x-ndjson")
+    results = {line["id"]: line for line in map(json.loads, response.text.splitlines())}
+    assert results["photos"]["status"] == 200
+    assert results["photos"]["body"] == [{"id": 1}]
+    assert results["post"]["body"]["title"] == "t"
+    assert results["me"]["body"]["username"] == "testuser_auth"
+    assert results["missing"]["status"] == 404
+    assert all(result["duration_ms"] >= 0 for result in results.values())
+
+def test_batch_requires_authentication():
+    response = sync_client.post("/batch", json={"requests": [{"path": "/photos"}]})
+    assert response.status_code == 401
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_posts_expanded_joins_comments_and_author(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/posts").return_value = httpx.Response(
+        200, json=[{"userId": 1, "id": 1, "title": "t1"}, {"userId": 2, "id": 2, "title": "t2"}]
+    )
+    respx.get("https://jsonplaceholder.typicode.com/comments").return_value = httpx.Response(
+        200, json=[{"postId": 1, "id": 10, "body": "c"}, {"postId": 1, "id": 11, "body": "d"}]
+    )
+    respx.get("https://jsonplaceholder.typicode.com/users").return_value = httpx.Response(
+        200, json=[{"id": 1, "name": "Leanne"}]
+    )
+    response = sync_client.get("/posts/expanded?limit=1", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["x-next-cursor"] == "1"
+    [post] = response.json()
+    assert [comment["id"] for comment in post["comments"]] == [10, 11]
+    assert post["author"] == {"id": 1, "name": "Leanne"}
+    [post] = sync_client.get("/posts/expanded?cursor=1", headers=auth_headers).json()
+    assert post["comments"] == [] and post["author"] is None
+    assert respx.calls.call_count == 3
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_expanded_endpoint_follows_the_route_config():
+    from registry import PostExpansion
+    mount_proxy_route(ProxyRoute(
+        name="articles", path="/test-articles", upstream="https://example.test/articles", resource="article",
+        auth=False, index="posts", expand=PostExpansion(comments="comments", authors="users"),
+    ))
+    mount_proxy_route(ProxyRoute(
+        name="notes", path="/test-notes", upstream="https://example.test/notes", resource="note", auth=False, index="posts",
+    ))
+    respx.get("https://example.test/articles").return_value = httpx.Response(200, json=[{"userId": 1, "id": 1}])
+    respx.get("https://jsonplaceholder.typicode.com/comments").return_value = httpx.Response(200, json=[])
+    respx.get("https://jsonplaceholder.typicode.com/users").return_value = httpx.Response(200, json=[{"id": 1}])
+    # Mounted under the route's own path and with its auth setting
+    response = sync_client.get("/test-articles/expanded")
+    assert response.status_code == 200
+    assert response.json() == [{"userId": 1, "id": 1, "comments": [], "author": {"id": 1}}]
+    # Routes without `expand` get no such endpoint ("expanded" is not an id)
+    assert sync_client.get("/test-notes/expanded").status_code == 422
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_get_photos_as_ndjson(auth_headers):
+    respx.get("https://jsonplaceholder.typicode.com/photos").return_value = httpx.Response(
+        200, json=[{"albumId": 1, "id": i, "title": f"photo{i}", "url": "u", "thumbnailUrl": "t"} for i in range(1, 4)]
+    )
+    response = sync_client.get("/photos?format=ndjson&fields=id&limit=2", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/x-ndjson"
+    assert response.headers["x-next-cursor"] == "2"
+    assert response.text == '{"id":1}\n{"id":2}\n'
+    assert sync_client.get("/photos?format=xml", headers=auth_headers).status_code == 422
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_streamed_route_passes_upstream_bytes_through(auth_headers):
+    mount_proxy_route(ProxyRoute(
+        name="streamed", path="/test-streamed", upstream="https://example.test/big", resource="item", stream=True
+    ))
+    body = b'[' + b','.join(b'{"id":%d}' % i for i in range(2000)) + b']'
+    respx.get("https://example.test/big").return_value = httpx.Response(
+        200, content=body, headers={"content-type": "application/json", "etag": '"v1"'}
+    )
+    response = sync_client.get("/test-streamed", headers={**auth_headers, "Accept-Encoding": "identity"})
+    assert response.status_code == 200
+    assert response.content == body
+    assert response.headers["etag"] == '"v1"'
+    # Raw bytes are forwarded, so the upstream is only offered what the client accepts
+    assert respx.calls.last.request.headers["accept-encoding"] == "identity"
+
+    respx.get("https://example.test/big").side_effect = httpx.ConnectError("boom")
+    response = sync_client.get("/test-streamed", headers=auth_headers)
+    assert response.status_code == 503
+    assert response.json() == {"detail": "Could not connect to external item API"}
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_disk_cache_shares_fetches_and_warms_restarts(auth_headers, tmp_path, monkeypatch):
+    import main
+    from diskcache import DiskCache
+    monkeypatch.setattr(main, "disk_cache", DiskCache(str(tmp_path)))
+    respx.get("https://jsonplaceholder.typicode.com/todos").return_value = httpx.Response(200, json=[{"id": 1}])
+
+    first = sync_client.get("/todos", headers=auth_headers)
+    assert first.status_code == 200
+    assert main.disk_cache.writes == 1
+
+    # Another worker (or a restart) finds the fresh version on disk
+    response_cache.clear()
+    main.warm_from_disk()
+    second = sync_client.get("/todos", headers=auth_headers)
+    assert second.json() == [{"id": 1}]
+    assert second.headers["etag"] == first.headers["etag"]
+    assert respx.calls.call_count == 1
+
+    response_cache.clear()
+    third = sync_client.get("/todos", headers=auth_headers)
+    assert third.json() == [{"id": 1}]
+    assert respx.calls.call_count == 1
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_prefetch_refreshes_instead_of_adopting_an_aging_shared_version(tmp_path, monkeypatch):
+    import main
+    from diskcache import DiskCache
+    from payload import Payload
+    url = "https://jsonplaceholder.typicode.com/todos"
+    monkeypatch.setattr(main, "disk_cache", DiskCache(str(tmp_path)))
+    # Fetched 50 s into its 60 s TTL, so its refresh ahead of expiry is due
+    main.disk_cache.save(url, Payload.from_upstream(b'[{"id":1}]', upstream_etag='"v1"'), ttl=60, stored_at=time.time() - 50)
+    main.warm_from_disk()
+    route = respx.get(url).respond(304)
+
+    await main.prefetch_scheduler.resources["todos"].refresh()
+
+    assert route.call_count == 1
+    assert route.calls[0].request.headers["if-none-match"] == '"v1"'
+    assert response_cache.get_entry(url).expires_at - time.monotonic() > 55
+    assert main.disk_cache.index.read(url).remaining_ttl() > 55
+
+def publish_todos_later(directory, ready):
+    from diskcache import DiskCache
+    from payload import Payload
+    disk = DiskCache(directory)
+    assert disk.index.try_lease("https://jsonplaceholder.typicode.com/todos", 30)
+    ready.set()
+    time.sleep(0.3)
+    disk.save("https://jsonplaceholder.typicode.com/todos", Payload.from_upstream(b'[{"id":2}]'), ttl=60)
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_worker_waits_for_the_refresh_lease_holder(auth_headers, tmp_path, monkeypatch):
+    import main
+    import multiprocessing
+    from diskcache import DiskCache
+    monkeypatch.setattr(main, "disk_cache", DiskCache(str(tmp_path)))
+    route = respx.get("https://jsonplaceholder.typicode.com/todos").respond(200, json=[{"id": 1}])
+
+    ready = multiprocessing.Event()
+    other_worker = multiprocessing.Process(target=publish_todos_later, args=(str(tmp_path), ready))
+    other_worker.start()
+    try:
+        assert ready.wait(5)
+        response = sync_client.get("/todos", headers=auth_headers)
+    finally:
+        other_worker.join()
+    assert response.json() == [{"id": 2}]
+    assert route.call_count == 0
+    assert main.disk_cache.stats()["index"]["leases_denied"] == 1
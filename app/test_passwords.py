@@ -0,0 +1,151 @@
+import asyncio
+import threading
+import time
+
+import pytest
+from passlib.context import CryptContext
+
+from passwords import PasswordCost, PasswordPool, PasswordPoolFull, PasswordSettings, calibrate
+
+# Cheapest bcrypt cost, to keep the tests fast
+context = CryptContext(schemes=["bcrypt"], bcrypt__rounds=4)
+
+
+class BlockingContext:
+    """Stands in for a CryptContext whose jobs wait for the test to release them."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def hash(self, secret):
+        assert self.release.wait(5)
+        return "hashed-" + secret
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("engine", ["thread", "process"])
+async def test_hash_and_verify_run_in_the_pool(engine):
+    pool = PasswordPool(context, engine=engine, workers=2, max_queue=8)
+    await pool.start()
+    hashed = await pool.hash("secret")
+    assert await pool.verify("secret", hashed)
+    assert not await pool.verify("wrong", hashed)
+    with pytest.raises(ValueError):
+        await pool.verify("secret", "not-a-hash")
+    stats = pool.stats()
+    assert stats["engine"] == engine
+    assert stats["completed"] == 4
+    assert stats["running"] == stats["queued"] == 0
+    assert stats["warm_up_ms"] is not None
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_event_loop_keeps_running_during_jobs():
+    blocking = BlockingContext()
+    pool = PasswordPool(blocking, workers=1, max_queue=8)
+    job = asyncio.create_task(pool.hash("a"))
+    for _ in range(5):
+        await asyncio.sleep(0.001)
+    assert not job.done()
+    assert pool.stats()["utilization"] == 1.0
+    blocking.release.set()
+    assert await job == "hashed-a"
+    pool.close()
+
+
+@pytest.mark.asyncio
+async def test_jobs_queued_behind_busy_workers_are_batched():
+    blocking = BlockingContext()
+    pool = PasswordPool(blocking, workers=1, max_queue=8, batch_size=4)
+    first = asyncio.create_task(pool.hash("first"))
+    await asyncio.sleep(0)
+    rest = [asyncio.create_task(pool.hash(str(i))) for i in range(6)]
+    await asyncio.sleep(0)
+    assert pool.queued == 6
+    blocking.release.set()
+    assert await asyncio.gather(first, *rest) == ["hashed-first"] + [f"hashed-{i}" for i in range(6)]
+    stats = pool.stats()
+    assert stats["batches"] == 3  # 1, then 4, then 2
+    assert stats["max_queue_wait_ms"] > 0
+    pool.close()
+
+
+class SleepingContext:
+    """Stands in for a CryptContext whose hashes take 50 ms."""
+
+    def hash(self, secret):
+        time.sleep(0.05)
+        return "hashed-" + secret
+
+
+@pytest.mark.asyncio
+async def test_a_burst_is_spread_across_all_workers():
+    pool = PasswordPool(SleepingContext(), workers=4, max_queue=16, batch_size=8)
+    await asyncio.gather(*(pool.hash(str(i)) for i in range(12)))
+    # 4 singles, then the 8 queued jobs in batches of at most 2, rather than
+    # all 8 run one after another by the first worker to free up
+    assert pool.stats()["batches"] >= 8
+    pool.close()
+
+
+def test_only_the_process_engine_batches_by_default():
+    assert PasswordPool(context, engine="thread").batch_size == 1
+    assert PasswordPool(context, engine="process").batch_size == 8
+
+
+@pytest.mark.asyncio
+async def test_jobs_beyond_the_queue_limit_are_rejected():
+    blocking = BlockingContext()
+    pool = PasswordPool(blocking, workers=1, max_queue=1)
+    running = asyncio.create_task(pool.hash("a"))
+    await asyncio.sleep(0)
+    waiting = asyncio.create_task(pool.hash("b"))
+    await asyncio.sleep(0)
+    with pytest.raises(PasswordPoolFull):
+        await pool.hash("c")
+    blocking.release.set()
+    await asyncio.gather(running, waiting)
+    assert pool.stats()["rejected"] == 1
+    assert pool.stats()["peak_queued"] == 1
+    pool.close()
+
+
+def test_process_engine_defaults_to_cpu_count(monkeypatch):
+    monkeypatch.setattr("os.cpu_count", lambda: 16)
+    assert PasswordSettings(engine="process").worker_count() == 16
+    assert PasswordSettings(engine="thread").worker_count() == 4
+    assert PasswordSettings(engine="process", workers=3).worker_count() == 3
+
+
+def doubling_cost(rounds):
+    """Verify seconds for a host where cost 4 takes a millisecond."""
+    return 0.001 * 2 ** (rounds - 4)
+
+
+def test_calibration_picks_the_highest_cost_within_the_target():
+    measured = []
+
+    def measure(rounds):
+        measured.append(rounds)
+        return doubling_cost(rounds)
+
+    assert calibrate(50, 4, 16, measure) == (9, 32.0)
+    # Stops measuring once doubling can no longer fit
+    assert measured == [4, 5, 6, 7, 8, 9]
+
+
+def test_calibration_stays_within_its_bounds():
+    assert calibrate(1, 10, 16, doubling_cost) == (10, 64.0)
+    assert calibrate(10_000, 4, 8, doubling_cost) == (8, 16.0)
+
+
+def test_configured_cost_marks_cheaper_hashes_for_update():
+    cost_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__default_rounds=4)
+    outdated = cost_context.hash("secret")
+    cost = PasswordCost()
+    cost.configure(cost_context, PasswordSettings(rounds=5))
+    assert cost_context.needs_update(outdated)
+    assert not cost_context.needs_update(cost_context.hash("secret"))
+    assert cost.stats()["rounds"] == 5
+    assert cost.stats()["source"] == "configured"
@@ -0,0 +1,102 @@
+import gzip
+import json
+
+from email.utils import formatdate
+
+from payload import Payload, ndjson_lines, normalize_json
+
+
+def test_payload_is_normalized_and_carries_validators():
+    raw = b'[\n  {\n    "id": 1,\n    "title": "photo1"\n  }\n]'
+    payload = Payload.from_upstream(raw)
+
+    assert json.loads(payload.body) == [{"id": 1, "title": "photo1"}]
+    assert payload.body == normalize_json(raw)
+    assert payload.content_length == len(payload.body)
+    assert payload.etag.startswith('"') and payload.etag.endswith('"')
+
+
+def test_payload_response_sends_bytes_untouched():
+    payload = Payload.from_upstream(b'{"a": 1}', normalize=False)
+    response = payload.to_response()
+
+    assert response.body == b'{"a": 1}'
+    assert response.headers["content-length"] == "8"
+    assert response.headers["etag"] == payload.etag
+    assert response.media_type == "application/json"
+
+
+def test_identical_bodies_share_an_etag():
+    assert Payload(b"[1,2]").etag == Payload(b"[1,2]").etag
+    assert Payload(b"[1,2]").etag != Payload(b"[1,3]").etag
+
+
+LARGE_BODY = b"[" + b",".join(b'{"id":%d,"title":"photo title"}' % i for i in range(200)) + b"]"
+
+
+def test_large_payload_gets_gzip_variant():
+    payload = Payload.from_upstream(LARGE_BODY)
+
+    assert "gzip" in payload.encodings
+    assert gzip.decompress(payload.encodings["gzip"]) == payload.body
+    assert payload.size == payload.content_length + sum(map(len, payload.encodings.values()))
+
+
+def test_small_payload_is_not_compressed():
+    assert Payload.from_upstream(b"[1,2,3]").encodings == {}
+
+
+def test_encoding_negotiation_honours_q_values():
+    payload = Payload(b"x" * 10, encodings={"br": b"b", "gzip": b"g"})
+
+    assert payload.select_encoding("gzip, deflate") == "gzip"
+    assert payload.select_encoding("gzip;q=0.5, br") == "br"
+    assert payload.select_encoding("br;q=0, gzip;q=0.1") == "gzip"
+    assert payload.select_encoding("*") == "br"
+    assert payload.select_encoding("identity") == "identity"
+    assert payload.select_encoding(None) == "identity"
+
+
+def test_compressed_response_has_own_etag_and_vary():
+    payload = Payload.from_upstream(LARGE_BODY)
+    plain = payload.to_response({"accept-encoding": "identity"})
+    compressed = payload.to_response({"accept-encoding": "gzip"})
+
+    assert compressed.headers["content-encoding"] == "gzip"
+    assert compressed.headers["vary"] == "Accept-Encoding"
+    assert plain.headers["vary"] == "Accept-Encoding"
+    assert "content-encoding" not in plain.headers
+    assert compressed.headers["etag"] != plain.headers["etag"]
+    assert int(compressed.headers["content-length"]) < int(plain.headers["content-length"])
+
+
+def test_if_none_match_returns_304_for_any_representation():
+    payload = Payload.from_upstream(LARGE_BODY)
+    gzip_etag = payload.to_response({"accept-encoding": "gzip"}).headers["etag"]
+
+    for validator in (payload.etag, gzip_etag, f"W/{payload.etag}", '"other", ' + payload.etag, "*"):
+        response = payload.to_response({"if-none-match": validator, "accept-encoding": "gzip"})
+        assert response.status_code == 304
+        assert response.body == b""
+        assert response.headers["etag"] == gzip_etag
+
+    assert payload.to_response({"if-none-match": '"other"'}).status_code == 200
+
+
+def test_if_modified_since_is_honoured_unless_if_none_match_is_sent():
+    payload = Payload(b"[]", last_modified=1_700_000_000)
+    last_modified = payload.to_response().headers["last-modified"]
+    assert last_modified == formatdate(1_700_000_000, usegmt=True)
+
+    assert payload.to_response({"if-modified-since": last_modified}).status_code == 304
+    earlier = formatdate(1_600_000_000, usegmt=True)
+    assert payload.to_response({"if-modified-since": earlier}).status_code == 200
+    assert payload.to_response({"if-modified-since": "garbage"}).status_code == 200
+    headers = {"if-modified-since": last_modified, "if-none-match": '"other"'}
+    assert payload.to_response(headers).status_code == 200
+
+
+def test_ndjson_lines_batches_records():
+    chunks = list(ndjson_lines((str(i).encode() for i in range(5)), batch_size=2))
+    assert chunks == [b"0\n1\n", b"2\n3\n", b"4\n"]
+    assert list(ndjson_lines([])) == []
@@ -0,0 +1,87 @@
+import json
+
+import pytest
+
+from payload import Payload, QueryError, dumps
+from photos import PhotoStore, StringColumn
+
+PHOTOS = [
+    {"albumId": album_id, "id": (album_id - 1) * 3 + n, "title": f"t{n}", "url": f"u{n}", "thumbnailUrl": f"th{n}"}
+    for album_id in (2, 1)
+    for n in range(1, 4)
+]
+
+
+def query(**params):
+    body, next_cursor = PhotoStore(PHOTOS).query(**params)
+    return json.loads(body), next_cursor
+
+
+def test_album_filter_uses_contiguous_range():
+    index = PhotoStore(PHOTOS)
+    assert index.album_ranges == {1: (0, 3), 2: (3, 6)}
+
+    rows, next_cursor = query(album_id=2)
+    assert [row["id"] for row in rows] == [4, 5, 6]
+    assert next_cursor is None
+    assert query(album_id=99) == ([], None)
+
+
+def test_cursor_pagination_walks_all_rows_once():
+    seen, cursor = [], None
+    while True:
+        rows, cursor = query(limit=4, cursor=cursor)
+        seen.extend(row["id"] for row in rows)
+        if cursor is None:
+            break
+    assert sorted(seen) == list(range(1, 7))
+
+
+def test_cursor_pagination_within_album():
+    rows, cursor = query(album_id=1, limit=2)
+    assert [row["id"] for row in rows] == [1, 2]
+    rows, cursor = query(album_id=1, limit=2, cursor=cursor)
+    assert [row["id"] for row in rows] == [3]
+    assert cursor is None
+
+
+def test_field_projection():
+    rows, _ = query(album_id=1, fields="id,thumbnailUrl")
+    assert rows[0] == {"id": 1, "thumbnailUrl": "th1"}
+
+
+@pytest.mark.parametrize("params", [{"fields": "id,secret"}, {"cursor": "abc"}, {"cursor": "-1"}])
+def test_invalid_parameters_are_rejected(params):
+    with pytest.raises(QueryError):
+        query(**params)
+
+
+def test_index_is_built_once_per_payload():
+    payload = Payload(dumps(PHOTOS))
+    first = payload.derive("photos", PhotoStore.from_payload)
+    assert payload.derive("photos", PhotoStore.from_payload) is first
+
+
+def test_rows_serialize_like_json_including_missing_values():
+    rows = [{"id": 1, "title": 'quote " and ü', "url": None}]
+    store = PhotoStore(rows)
+    assert json.loads(store.encode_row(0)) == {
+        "albumId": None, "id": 1, "title": 'quote " and ü', "url": None, "thumbnailUrl": None
+    }
+
+
+def test_string_pool_interns_repeated_values():
+    column = StringColumn(["a", "b", "a", "a"])
+    assert column.distinct == 2
+    assert [column.encoded(row) for row in range(4)] == [b'"a"', b'"b"', b'"a"', b'"a"']
+
+
+def test_memory_report_shows_columnar_savings():
+    photos = [
+        {"albumId": i // 50, "id": i, "title": f"title {i}", "url": f"https://x/600/{i % 7}", "thumbnailUrl": f"https://x/150/{i % 7}"}
+        for i in range(500)
+    ]
+    report = PhotoStore(photos).memory_report()
+    assert report["rows"] == 500
+    assert report["distinct_strings"]["url"] == 7
+    assert report["columnar_bytes"] < report["row_dicts_bytes"]
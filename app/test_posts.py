@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from payload import QueryError
+from posts import PostIndex
+
+POSTS = [{"userId": 1 + i // 4, "id": i + 1, "title": f"title {i + 1}", "body": f"body {i + 1}"} for i in range(10)]
+
+
+def ids(body):
+    return [post["id"] for post in json.loads(body)]
+
+
+def test_lookup_by_id():
+    index = PostIndex(POSTS)
+    assert json.loads(index.get(3)) == POSTS[2]
+    assert index.get(99) is None
+
+
+def test_filters_by_user_and_id():
+    index = PostIndex(POSTS)
+    assert ids(index.query(user_id=2)[0]) == [5, 6, 7, 8]
+    assert ids(index.query(user_id=2, post_id=6)[0]) == [6]
+    assert ids(index.query(user_id=1, post_id=6)[0]) == []
+    assert ids(index.query(user_id=42)[0]) == []
+
+
+def test_pagination_over_filtered_posts():
+    index = PostIndex(POSTS)
+    body, cursor = index.query(user_id=2, limit=3)
+    assert ids(body) == [5, 6, 7]
+    body, cursor = index.query(user_id=2, limit=3, cursor=cursor)
+    assert ids(body) == [8]
+    assert cursor is None
+
+
+def test_invalid_cursor_is_rejected():
+    with pytest.raises(QueryError):
+        PostIndex(POSTS).query(cursor="next")
@@ -0,0 +1,87 @@
+import pytest
+from pydantic import ValidationError
+
+from registry import DEFAULT_ROUTES_FILE, load_routes
+
+
+def write_routes(tmp_path, text):
+    path = tmp_path / "routes.yaml"
+    path.write_text(text)
+    return str(path)
+
+
+def test_default_routes_file_is_valid():
+    routes = load_routes(DEFAULT_ROUTES_FILE)
+    assert routes["photos"].index == "photos"
+    assert routes["posts"].index == "posts"
+    assert all(route.auth for route in routes.values())
+
+
+def test_routes_get_defaults(tmp_path):
+    path = write_routes(tmp_path, """
+routes:
+  - name: users
+    upstream: https://example.com/users
+    resource: user
+""")
+    route = load_routes(path)["users"]
+    assert route.path is None
+    assert route.auth and route.compress and route.prefetch
+    assert route.stale_if_error is None
+
+
+def test_routes_file_comes_from_env(tmp_path, monkeypatch):
+    path = write_routes(tmp_path, """
+routes:
+  - {name: todos, path: /todos, upstream: https://example.com/todos, resource: todo, auth: false}
+""")
+    monkeypatch.setenv("PROXY_ROUTES_FILE", path)
+    assert list(load_routes()) == ["todos"]
+
+
+def test_unknown_index_is_rejected(tmp_path):
+    path = write_routes(tmp_path, """
+routes:
+  - {name: todos, upstream: https://example.com/todos, resource: todo, index: todos}
+""")
+    with pytest.raises(ValidationError):
+        load_routes(path)
+
+
+def test_duplicate_names_are_rejected(tmp_path):
+    path = write_routes(tmp_path, """
+routes:
+  - {name: todos, upstream: https://example.com/todos, resource: todo}
+  - {name: todos, upstream: https://example.com/todos2, resource: todo}
+""")
+    with pytest.raises(ValueError, match="Duplicate"):
+        load_routes(path)
+
+
+def test_streamed_routes_cannot_be_indexed(tmp_path):
+    path = write_routes(tmp_path, """
+routes:
+  - {name: photos, upstream: https://example.com/photos, resource: photo, stream: true, index: photos}
+""")
+    with pytest.raises(ValidationError, match="cannot be indexed"):
+        load_routes(path)
+
+
+def test_default_posts_route_is_expanded():
+    expand = load_routes(DEFAULT_ROUTES_FILE)["posts"].expand
+    assert (expand.comments, expand.authors) == ("comments", "users")
+
+
+def test_expansion_needs_existing_routes_and_the_posts_index(tmp_path):
+    path = write_routes(tmp_path, """
+routes:
+  - {name: posts, upstream: https://example.com/posts, resource: post, index: posts, expand: {comments: comments, authors: users}}
+""")
+    with pytest.raises(ValueError, match="expands with comments"):
+        load_routes(path)
+    path = write_routes(tmp_path, """
+routes:
+  - {name: todos, upstream: https://example.com/todos, resource: todo, expand: {comments: todos, authors: todos}}
+""")
+    with pytest.raises(ValidationError, match="posts index"):
+        load_routes(path)
@@ -0,0 +1,88 @@
+import asyncio
+
+import pytest
+
+from scheduler import PrefetchScheduler, PrefetchSettings
+
+
+def make_scheduler(**overrides):
+    settings = PrefetchSettings(**{"enabled": True, "jitter": 0.0, "backoff_initial": 0.01, **overrides})
+    return PrefetchScheduler(settings)
+
+
+@pytest.mark.asyncio
+async def test_resources_are_refreshed_before_ttl_expiry():
+    scheduler = make_scheduler(refresh_ahead=0.5)
+    calls = []
+
+    async def refresh():
+        calls.append(1)
+
+    scheduler.register("photos", refresh, ttl=0.02)
+    await scheduler.start()
+    await asyncio.sleep(0.06)
+    await scheduler.stop()
+
+    status = scheduler.stats()["resources"]["photos"]
+    assert len(calls) >= 3
+    assert status["refreshes"] == len(calls)
+    assert status["last_error"] is None
+    assert status["last_refresh"] is not None
+
+
+@pytest.mark.asyncio
+async def test_failures_back_off_exponentially_and_record_error():
+    scheduler = make_scheduler(backoff_max=0.04)
+    scheduler.register("posts", None, ttl=60)
+    resource = scheduler.resources["posts"]
+
+    async def failing():
+        raise RuntimeError("upstream down")
+
+    resource.refresh = failing
+    delays = []
+    for _ in range(4):
+        await scheduler.run_once(resource)
+        delays.append(scheduler.next_delay(resource))
+
+    assert delays == [0.01, 0.02, 0.04, 0.04]
+    assert resource.consecutive_failures == 4
+    assert resource.last_error == "RuntimeError: upstream down"
+
+    async def working():
+        pass
+
+    resource.refresh = working
+    await scheduler.run_once(resource)
+    assert resource.consecutive_failures == 0
+    assert scheduler.next_delay(resource) == 60 * scheduler.settings.refresh_ahead
+
+
+@pytest.mark.asyncio
+async def test_concurrency_is_bounded():
+    scheduler = make_scheduler(max_concurrency=1)
+    running, peak = 0, 0
+
+    async def refresh():
+        nonlocal running, peak
+        running += 1
+        peak = max(peak, running)
+        await asyncio.sleep(0.01)
+        running -= 1
+
+    for name in ("a", "b", "c"):
+        scheduler.register(name, refresh, ttl=60)
+    await scheduler.start()
+    await asyncio.sleep(0.05)
+    await scheduler.stop()
+
+    assert peak == 1
+    assert all(status["refreshes"] == 1 for status in scheduler.stats()["resources"].values())
+
+
+@pytest.mark.asyncio
+async def test_disabled_scheduler_does_not_start():
+    scheduler = make_scheduler(enabled=False)
+    scheduler.register("photos", None, ttl=60)
+    await scheduler.start()
+    assert scheduler.stats()["running"] is False
@@ -0,0 +1,38 @@
+from search import SearchIndex, tokenize
+
+DOCUMENTS = {
+    1: "qui est esse\nest rerum tempore vitae",
+    2: "sunt aut facere repellat\nquia et suscipit",
+    3: "eum et est occaecati\nullam et saepe reiciendis",
+}
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("Qui EST, esse!") == ["qui", "est", "esse"]
+
+
+def test_bm25_ranks_documents_with_more_matches_first():
+    index = SearchIndex()
+    index.update(DOCUMENTS)
+    results = index.search("est esse", k=10)
+
+    assert [doc_id for doc_id, _ in results] == [1, 3]
+    assert results[0][1] > results[1][1] > 0
+    assert index.search("missing") == []
+    assert len(index.search("et est", k=1)) == 1
+
+
+def test_update_only_touches_changed_documents():
+    index = SearchIndex()
+    index.update(DOCUMENTS, version="v1")
+    changed = {**DOCUMENTS, 2: "brand new text"}
+    del changed[3]
+    changed[4] = "another document"
+    index.update(changed, version="v2")
+
+    assert index.version == "v2"
+    assert index.last_update == {"added": 1, "removed": 1, "changed": 1, "unchanged": 1}
+    assert index.search("suscipit") == []
+    assert [doc_id for doc_id, _ in index.search("brand")] == [2]
+    assert "occaecati" not in index.postings
+    assert index.total_length == sum(len(tokenize(text)) for text in changed.values())
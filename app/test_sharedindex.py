@@ -0,0 +1,130 @@
+import multiprocessing
+import threading
+import time
+
+from sharedindex import SEQ, SharedIndex, key_hash
+
+
+def test_publish_is_visible_to_other_mappings(tmp_path):
+    writer = SharedIndex(str(tmp_path / "index"), slots=8)
+    reader = SharedIndex(str(tmp_path / "index"))
+    assert reader.slots == 8
+    assert reader.read("a") is None
+    writer.publish("a", "ab" * 16, stored_at=time.time(), ttl=60)
+    state = reader.read("a")
+    assert state.etag == '"' + "ab" * 16 + '"'
+    assert 59 < state.remaining_ttl() <= 60
+    assert not state.leased()
+
+
+def test_keys_colliding_on_a_slot_are_probed(tmp_path):
+    index = SharedIndex(str(tmp_path / "index"), slots=2)
+    for key in ("a", "b"):
+        index.publish(key, key.encode().hex() * 16, stored_at=1.0, ttl=1.0)
+    assert index.read("a").digest == "61" * 16
+    assert index.read("b").digest == "62" * 16
+    # Full: further keys are neither stored nor refused a lease
+    index.publish("c", "63" * 16, stored_at=1.0, ttl=1.0)
+    assert index.read("c") is None
+    assert index.try_lease("c", 10)
+
+
+def test_reader_retries_while_a_write_is_in_progress(tmp_path):
+    index = SharedIndex(str(tmp_path / "index"), slots=4)
+    index.publish("a", "ab" * 16, stored_at=1.0, ttl=1.0)
+    offset = index._offset(index._find(key_hash("a")))
+    seq = SEQ.unpack_from(index._map, offset)[0]
+    SEQ.pack_into(index._map, offset, seq + 1)
+    threading.Timer(0.05, lambda: SEQ.pack_into(index._map, offset, seq + 2)).start()
+    assert index.read("a").digest == "ab" * 16
+    assert index.retries > 0
+
+
+def test_slot_left_mid_update_by_a_dead_writer_is_repaired(tmp_path):
+    index = SharedIndex(str(tmp_path / "index"), slots=4)
+    index.publish("a", "ab" * 16, stored_at=1.0, ttl=1.0)
+    assert index.try_lease("a", 30)
+    offset = index._offset(index._find(key_hash("a")))
+    # Killed between making the sequence odd and even again
+    SEQ.pack_into(index._map, offset, SEQ.unpack_from(index._map, offset)[0] + 1)
+    fresh = SharedIndex(str(tmp_path / "index"))
+    state = fresh.read("a")
+    assert state.digest == "ab" * 16
+    assert not state.leased()
+    assert SEQ.unpack_from(fresh._map, offset)[0] % 2 == 0
+    assert fresh.stats()["repairs"] == 1
+
+
+def test_writer_repairs_a_slot_left_mid_update(tmp_path):
+    index = SharedIndex(str(tmp_path / "index"), slots=4)
+    index.publish("a", "ab" * 16, stored_at=1.0, ttl=1.0)
+    offset = index._offset(index._find(key_hash("a")))
+    SEQ.pack_into(index._map, offset, SEQ.unpack_from(index._map, offset)[0] + 1)
+    index.publish("a", "cd" * 16, stored_at=2.0, ttl=1.0)
+    assert SEQ.unpack_from(index._map, offset)[0] % 2 == 0
+    assert index.read("a").digest == "cd" * 16
+
+
+def test_lease_is_exclusive_within_a_process(tmp_path):
+    index = SharedIndex(str(tmp_path / "index"), slots=4)
+    assert index.try_lease("a", 30)
+    assert not index.try_lease("a", 30)
+    index.release("a")
+    assert index.try_lease("a", 30)
+
+
+def test_lock_excludes_other_threads_of_the_process(tmp_path):
+    index = SharedIndex(str(tmp_path / "index"), slots=4)
+    inside = threading.Event()
+    leave = threading.Event()
+    overlapped = []
+
+    def hold():
+        with index._locked():
+            inside.set()
+            assert leave.wait(5)
+            overlapped.append(index._holding_lock())
+
+    def contend():
+        with index._locked():
+            overlapped.append(inside.is_set() and not leave.is_set())
+
+    holder = threading.Thread(target=hold)
+    holder.start()
+    assert inside.wait(5)
+    contender = threading.Thread(target=contend)
+    contender.start()
+    contender.join(0.1)
+    # Still waiting for the holder, which alone sees itself as the lock owner
+    assert contender.is_alive()
+    assert not index._holding_lock()
+    leave.set()
+    holder.join()
+    contender.join()
+    assert overlapped == [True, False]
+
+
+def hold_lease(path, ready):
+    index = SharedIndex(path)
+    assert index.try_lease("a", 30)
+    ready.set()
+    time.sleep(0.5)
+
+
+def test_lease_excludes_other_processes_until_published(tmp_path):
+    path = str(tmp_path / "index")
+    index = SharedIndex(path, slots=4)
+    ready = multiprocessing.Event()
+    child = multiprocessing.Process(target=hold_lease, args=(path, ready))
+    child.start()
+    try:
+        assert ready.wait(5)
+        assert index.read("a").leased()
+        assert not index.try_lease("a", 30)
+        index.publish("a", "ab" * 16, stored_at=time.time(), ttl=60)
+        assert not index.read("a").leased()
+        assert index.try_lease("a", 30)
+        index.release("a")
+        assert not index.read("a").leased()
+    finally:
+        child.join()
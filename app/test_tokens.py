@@ -0,0 +1,72 @@
+from tokens import RevokedTokens, TokenCache
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_claims_are_cached_until_exp():
+    clock = FakeClock()
+    cache = TokenCache(max_entries=10, clock=clock)
+    claims = {"sub": "alice", "exp": 1060}
+    assert cache.get("t1") is None
+    cache.put("t1", claims)
+    assert cache.get("t1") == claims
+    clock.now = 1060
+    assert cache.get("t1") is None
+    assert cache.stats()["expired"] == 1
+    assert cache.stats()["entries"] == 0
+
+
+def test_tokens_without_exp_are_not_cached():
+    cache = TokenCache(max_entries=10)
+    cache.put("t1", {"sub": "alice"})
+    assert cache.get("t1") is None
+
+
+def test_least_recently_used_token_is_evicted():
+    cache = TokenCache(max_entries=2, clock=FakeClock())
+    for token in ("a", "b"):
+        cache.put(token, {"sub": token, "exp": 2000})
+    cache.get("a")
+    cache.put("c", {"sub": "c", "exp": 2000})
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_invalidate_user_drops_all_their_tokens():
+    cache = TokenCache(max_entries=10, clock=FakeClock())
+    cache.put("a1", {"sub": "alice", "exp": 2000})
+    cache.put("a2", {"sub": "alice", "exp": 2000})
+    cache.put("b1", {"sub": "bob", "exp": 2000})
+    assert cache.invalidate_user("alice") == 2
+    assert cache.get("a1") is None and cache.get("a2") is None
+    assert cache.get("b1") is not None
+    assert cache.stats()["hit_ratio"] == round(1 / 3, 4)
+
+
+def test_disabled_cache_stores_nothing():
+    cache = TokenCache(max_entries=0)
+    cache.put("a", {"sub": "alice", "exp": 2 ** 40})
+    assert cache.get("a") is None
+
+
+def test_revocation_refuses_tokens_issued_before_it():
+    clock = FakeClock()
+    revoked = RevokedTokens(max_token_age=1800, clock=clock)
+    old = {"sub": "alice", "iat": clock.now - 1}
+    assert not revoked.is_revoked(old)
+    revoked.revoke("alice")
+    assert revoked.is_revoked(old)
+    assert revoked.is_revoked({"sub": "alice"})
+    assert not revoked.is_revoked({"sub": "alice", "iat": clock.now + 0.5})
+    assert not revoked.is_revoked({"sub": "bob", "iat": clock.now - 1})
+    # Forgotten once every token it could refuse has expired
+    clock.now += 1801
+    revoked.revoke("bob")
+    assert revoked.stats() == {"users": 1, "revocations": 2, "refused": 2}
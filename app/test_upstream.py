@@ -0,0 +1,348 @@
+import asyncio
+
+import httpx
+import pytest
+import respx
+
+from upstream import (
+    BulkheadFullError,
+    CircuitBreaker,
+    CircuitOpenError,
+    DeadlineExceeded,
+    LatencyTracker,
+    UpstreamClient,
+    UpstreamSettings,
+)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_per_host_cap_limits_concurrent_requests():
+    upstream = UpstreamClient(UpstreamSettings(max_connections_per_host=2))
+    peak = 0
+
+    async def slow_response(request):
+        nonlocal peak
+        peak = max(peak, upstream.in_flight)
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=[])
+
+    respx.get(url__startswith="https://example.test/items").mock(side_effect=slow_response)
+    await asyncio.gather(*(upstream.get(f"https://example.test/items/{i}") for i in range(6)))
+
+    assert peak == 2
+    assert upstream.requests_total == 6
+    assert upstream.stats()["in_flight_per_host"] == {"example.test": 0}
+    await upstream.close()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_network_errors_are_counted():
+    upstream = UpstreamClient(UpstreamSettings(retry_attempts=0))
+    respx.get("https://example.test/items").side_effect = httpx.ConnectError("boom")
+    with pytest.raises(httpx.RequestError):
+        await upstream.get("https://example.test/items")
+    await upstream.close()
+    assert upstream.errors_total == 1
+
+
+@pytest.mark.asyncio
+async def test_close_releases_client_and_restarts_lazily():
+    upstream = UpstreamClient(UpstreamSettings())
+    await upstream.start()
+    first = upstream.client
+    await upstream.close()
+    assert first.is_closed
+    assert upstream.client is not first
+    await upstream.close()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_concurrent_gets_for_same_url_are_coalesced():
+    upstream = UpstreamClient(UpstreamSettings())
+
+    async def slow_response(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=[1, 2, 3])
+
+    route = respx.get("https://example.test/items").mock(side_effect=slow_response)
+    responses = await asyncio.gather(*(upstream.get("https://example.test/items") for _ in range(5)))
+    await upstream.close()
+
+    assert route.call_count == 1
+    assert all(response.json() == [1, 2, 3] for response in responses)
+    assert upstream.single_flight.stats() == {"calls": 5, "executions": 1, "coalesced": 4, "in_flight": 0}
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_coalesced_callers_share_the_error():
+    upstream = UpstreamClient(UpstreamSettings(retry_attempts=0))
+
+    async def failing_response(request):
+        await asyncio.sleep(0.01)
+        raise httpx.ConnectError("down")
+
+    route = respx.get("https://example.test/items").mock(side_effect=failing_response)
+    results = await asyncio.gather(
+        *(upstream.get("https://example.test/items") for _ in range(3)), return_exceptions=True
+    )
+    await upstream.close()
+
+    assert route.call_count == 1
+    assert all(isinstance(result, httpx.ConnectError) for result in results)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_cancelled_caller_does_not_cancel_shared_fetch():
+    upstream = UpstreamClient(UpstreamSettings())
+
+    async def slow_response(request):
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json={"ok": True})
+
+    respx.get("https://example.test/items").mock(side_effect=slow_response)
+    first = asyncio.ensure_future(upstream.get("https://example.test/items"))
+    second = asyncio.ensure_future(upstream.get("https://example.test/items"))
+    await asyncio.sleep(0)
+    first.cancel()
+    response = await second
+    await upstream.close()
+
+    assert response.json() == {"ok": True}
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_revalidate_counts_not_modified_and_full_fetches():
+    upstream = UpstreamClient(UpstreamSettings())
+    route = respx.get("https://example.test/items")
+    route.side_effect = [httpx.Response(304), httpx.Response(200, json=[]), httpx.Response(200, json=[])]
+
+    assert (await upstream.revalidate("https://example.test/items", etag='"a"')).status_code == 304
+    assert (await upstream.revalidate("https://example.test/items", last_modified="Tue, 14 Nov 2023 22:13:20 GMT")).status_code == 200
+    assert (await upstream.revalidate("https://example.test/items")).status_code == 200
+    await upstream.close()
+
+    assert route.calls[0].request.headers["if-none-match"] == '"a"'
+    assert "if-none-match" not in route.calls[1].request.headers
+    assert route.calls[1].request.headers["if-modified-since"] == "Tue, 14 Nov 2023 22:13:20 GMT"
+    assert upstream.stats()["revalidation"] == {"conditional_requests": 2, "not_modified": 1, "full_fetches": 2}
+
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_coalesced_revalidations_are_counted_once():
+    upstream = UpstreamClient(UpstreamSettings())
+
+    async def slow_response(request):
+        await asyncio.sleep(0.01)
+        return httpx.Response(200, json=[])
+
+    route = respx.get("https://example.test/items").mock(side_effect=slow_response)
+    responses = await asyncio.gather(
+        *(upstream.revalidate("https://example.test/items", etag='"a"') for _ in range(20))
+    )
+    await upstream.close()
+
+    assert all(response.status_code == 200 for response in responses)
+    assert route.call_count == 1
+    assert upstream.stats()["revalidation"] == {"conditional_requests": 1, "not_modified": 0, "full_fetches": 1}
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_breaker_opens_on_failure_rate_and_recovers_through_half_open():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=4, min_calls=4, failure_rate=0.5, open_seconds=10, half_open_calls=1, clock=clock)
+    for success in (True, False, True, False):
+        period = breaker.allow()
+        assert period is not None
+        breaker.record(period, success)
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+
+    clock.now += 10
+    probe = breaker.allow()
+    assert probe is not None
+    assert breaker.state == "half_open"
+    assert breaker.allow() is None  # only one probe at a time
+    breaker.record(probe, True)
+    assert breaker.state == "closed"
+    assert breaker.stats()["transitions"] == {"closed->open": 1, "open->half_open": 1, "half_open->closed": 1}
+
+
+def test_failed_probe_reopens_breaker():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=2, min_calls=2, failure_rate=1.0, open_seconds=5, half_open_calls=1, clock=clock)
+    for _ in range(2):
+        breaker.record(breaker.allow(), False)
+    clock.now += 5
+    probe = breaker.allow()
+    assert probe is not None
+    breaker.record(probe, False)
+    assert breaker.state == "open"
+    assert breaker.allow() is None
+
+
+def test_late_outcome_from_before_opening_is_not_taken_for_the_probe():
+    clock = FakeClock()
+    breaker = CircuitBreaker(window=2, min_calls=2, failure_rate=1.0, open_seconds=5, half_open_calls=1, clock=clock)
+    late = breaker.allow()
+    for _ in range(2):
+        breaker.record(breaker.allow(), False)
+    clock.now += 5
+    probe = breaker.allow()
+    # The call let through while closed finishes while the probe is in flight
+    breaker.record(late, True)
+    assert breaker.state == "half_open"
+    assert breaker.allow() is None
+    breaker.record(late, False)
+    assert breaker.state == "half_open"
+    breaker.record(probe, True)
+    assert breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_open_breaker_fails_fast_without_calling_upstream():
+    upstream = UpstreamClient(UpstreamSettings(breaker_window=2, breaker_min_calls=2, breaker_failure_rate=0.5))
+    route = respx.get(url__startswith="https://example.test/").mock(return_value=httpx.Response(500))
+    for i in range(2):
+        await upstream.get(f"https://example.test/{i}")
+    with pytest.raises(CircuitOpenError):
+        await upstream.get("https://example.test/2")
+    await upstream.close()
+
+    assert route.call_count == 2
+    assert upstream.stats()["breakers"]["example.test"]["state"] == "open"
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_bulkhead_rejects_calls_beyond_queue_limit():
+    upstream = UpstreamClient(UpstreamSettings(max_connections_per_host=1, max_queued_per_host=1))
+
+    async def slow_response(request):
+        await asyncio.sleep(0.02)
+        return httpx.Response(200, json=[])
+
+    respx.get(url__startswith="https://example.test/").mock(side_effect=slow_response)
+    results = await asyncio.gather(
+        *(upstream.get(f"https://example.test/{i}") for i in range(3)), return_exceptions=True
+    )
+    await upstream.close()
+
+    assert sum(isinstance(result, BulkheadFullError) for result in results) == 1
+    assert sum(isinstance(result, httpx.Response) for result in results) == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_transient_failures_are_retried():
+    upstream = UpstreamClient(UpstreamSettings(retry_attempts=2, retry_backoff_initial=0.001))
+    route = respx.get("https://example.test/items")
+    route.side_effect = [httpx.ConnectError("reset"), httpx.Response(503), httpx.Response(200, json=[1])]
+
+    response = await upstream.get("https://example.test/items")
+    await upstream.close()
+
+    assert response.json() == [1]
+    assert route.call_count == 3
+    assert upstream.stats()["retries"]["retries"] == 2
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_retries_stop_after_configured_attempts():
+    upstream = UpstreamClient(UpstreamSettings(retry_attempts=1, retry_backoff_initial=0.001))
+    route = respx.get("https://example.test/items").mock(return_value=httpx.Response(503))
+
+    response = await upstream.get("https://example.test/items")
+    await upstream.close()
+
+    assert response.status_code == 503
+    assert route.call_count == 2
+
+
+def test_retry_delay_uses_capped_full_jitter():
+    upstream = UpstreamClient(UpstreamSettings(retry_backoff_initial=0.1, retry_backoff_max=0.3))
+    for attempt in range(1, 6):
+        assert 0 <= upstream.retry_delay(attempt) <= min(0.1 * 2 ** (attempt - 1), 0.3)
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_deadline_bounds_the_whole_call():
+    upstream = UpstreamClient(UpstreamSettings(retry_attempts=5))
+
+    async def hanging_response(request):
+        await asyncio.sleep(1)
+        return httpx.Response(200)
+
+    respx.get("https://example.test/items").mock(side_effect=hanging_response)
+    with pytest.raises(DeadlineExceeded):
+        await upstream.get("https://example.test/items", deadline=0.02)
+    await upstream.close()
+
+    assert upstream.stats()["retries"]["deadlines_exceeded"] == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_slow_request_is_hedged_and_hedge_wins():
+    upstream = UpstreamClient(UpstreamSettings(hedge_enabled=True, hedge_min_samples=3, retry_attempts=0))
+    for _ in range(3):
+        upstream._latencies.setdefault("example.test", LatencyTracker()).record(0.01)
+    delays = iter([1.0, 0.0])
+
+    async def response(request):
+        await asyncio.sleep(next(delays))
+        return httpx.Response(200, json={"ok": True})
+
+    respx.get("https://example.test/items").mock(side_effect=response)
+    result = await upstream.get("https://example.test/items", deadline=0.5)
+    await upstream.close()
+
+    # The slow primary was cancelled once the hedge answered
+    assert result.json() == {"ok": True}
+    assert upstream.in_flight == 0
+    assert upstream.hedges_fired == 1
+    assert upstream.hedges_won == 1
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_stream_holds_bulkhead_slot_until_body_is_read():
+    upstream = UpstreamClient(UpstreamSettings())
+    respx.get("https://example.test/big").return_value = httpx.Response(200, content=b"x" * 10000)
+    async with upstream.stream("https://example.test/big") as response:
+        assert upstream.stats()["in_flight_per_host"] == {"example.test": 1}
+        body = b"".join([chunk async for chunk in response.aiter_raw()])
+    assert body == b"x" * 10000
+    assert upstream.stats()["in_flight_per_host"] == {"example.test": 0}
+    assert upstream.stats()["streaming"] == {"streams": 1, "bytes": 10000}
+    await upstream.close()
+
+
+@pytest.mark.asyncio
+@respx.mock
+async def test_stream_errors_count_against_the_breaker():
+    upstream = UpstreamClient(UpstreamSettings())
+    respx.get("https://example.test/big").side_effect = httpx.ConnectError("boom")
+    with pytest.raises(httpx.ConnectError):
+        async with upstream.stream("https://example.test/big"):
+            pass
+    assert upstream.errors_total == 1
+    assert upstream.breaker_for("example.test").stats()["failure_rate"] == 1.0
+    await upstream.close()
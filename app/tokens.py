@@ -0,0 +1,150 @@
+"""
+Cache of verified JWT claims.
+
+Clients present the same token on every request until it expires, so the
+claims of a token that passed signature verification are kept, keyed by the
+token's SHA-256 digest, until its `exp` claim passes. Only the digest is
+stored, never the token itself. The cache is bounded and evicts the least
+recently used tokens; all tokens of a user can be dropped at once when that
+user's access is revoked.
+
+Revocation itself is recorded separately, as a per-user cut-off time: tokens
+issued (`iat`) before it are refused however valid their signature, so a
+revoked token cannot be verified back into the cache.
+"""
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class TokenCacheSettings(BaseSettings):
+    """Verified-token cache bounds, overridable with TOKEN_CACHE_* env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="TOKEN_CACHE_")
+
+    enabled: bool = True
+    max_entries: int = 10000
+
+
+def token_digest(token: str) -> bytes:
+    return hashlib.sha256(token.encode("utf-8")).digest()
+
+
+class TokenCache:
+    def __init__(self, max_entries: int, clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.clock = clock
+        # digest -> (claims, expires_at)
+        self._entries: OrderedDict[bytes, tuple[dict, float]] = OrderedDict()
+        self._by_user: dict[str, set[bytes]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        """The cached claims of `token`, or None if it has to be verified."""
+        digest = token_digest(token)
+        entry = self._entries.get(digest)
+        if entry is None:
+            self.misses += 1
+            return None
+        claims, expires_at = entry
+        if self.clock() >= expires_at:
+            self._remove(digest)
+            self.expired += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(digest)
+        self.hits += 1
+        return claims
+
+    def put(self, token: str, claims: dict):
+        """Remembers the claims of a verified token until its `exp`."""
+        expires_at = claims.get("exp")
+        if not isinstance(expires_at, (int, float)) or self.max_entries <= 0:
+            # Without an expiry there is no safe point to forget the token
+            return
+        digest = token_digest(token)
+        if digest in self._entries:
+            self._remove(digest)
+        self._entries[digest] = (claims, expires_at)
+        subject = claims.get("sub")
+        if subject is not None:
+            self._by_user.setdefault(subject, set()).add(digest)
+        while len(self._entries) > self.max_entries:
+            self._remove(next(iter(self._entries)))
+            self.evictions += 1
+
+    def _remove(self, digest: bytes):
+        claims, _ = self._entries.pop(digest)
+        subject = claims.get("sub")
+        digests = self._by_user.get(subject)
+        if digests is not None:
+            digests.discard(digest)
+            if not digests:
+                del self._by_user[subject]
+
+    def invalidate_user(self, username: str) -> int:
+        """Forgets every cached token of `username`; returns how many there were."""
+        digests = self._by_user.pop(username, set())
+        for digest in digests:
+            self._entries.pop(digest, None)
+        self.invalidations += len(digests)
+        return len(digests)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_user.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "expired": self.expired,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+class RevokedTokens:
+    """Per-user cut-off times; tokens issued before their user's are refused."""
+
+    def __init__(self, max_token_age: float, clock: Callable[[], float] = time.time):
+        # No token outlives this, so older cut-offs can be forgotten
+        self.max_token_age = max_token_age
+        self.clock = clock
+        self._revoked_before: dict[str, float] = {}
+        self.revocations = 0
+        self.refused = 0
+
+    def revoke(self, username: str):
+        """Refuses every token issued to `username` until now."""
+        now = self.clock()
+        self._revoked_before = {
+            user: before for user, before in self._revoked_before.items() if before > now - self.max_token_age
+        }
+        self._revoked_before[username] = now
+        self.revocations += 1
+
+    def is_revoked(self, claims: dict) -> bool:
+        before = self._revoked_before.get(claims.get("sub"))
+        if before is None:
+            return False
+        issued_at = claims.get("iat")
+        # A token without `iat` may predate the revocation
+        if not isinstance(issued_at, (int, float)) or issued_at < before:
+            self.refused += 1
+            return True
+        return False
+
+    def stats(self) -> dict:
+        return {"users": len(self._revoked_before), "revocations": self.revocations, "refused": self.refused}
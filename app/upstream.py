@@ -0,0 +1,576 @@
+"""
+Shared, app-lifetime HTTP client for the upstream (JSONPlaceholder) APIs.
+
+A single pooled httpx.AsyncClient is created when the app starts and closed
+on shutdown, so proxy endpoints reuse keep-alive connections instead of
+paying a TCP+TLS handshake on every request.
+
+Each upstream host is guarded by a circuit breaker and a bulkhead: when the
+host keeps failing, or too many calls are already waiting on it, requests
+fail fast with an httpx.RequestError subclass instead of tying up the event
+loop until a timeout. Callers treat those like any other network error
+(503, or stale data from the cache).
+
+Idempotent GETs are retried with exponential backoff and full jitter, can be
+hedged (a second request fired once the host's p95 latency has elapsed) and
+are bounded by a per-call deadline.
+
+Large bodies can also be streamed straight through without being buffered;
+the host's bulkhead slot is then held until the body has been read.
+"""
+import asyncio
+import random
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Awaitable, Callable, Hashable, Optional
+from urllib.parse import urlsplit
+
+import httpx
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class UpstreamSettings(BaseSettings):
+    """Pool limits and timeouts, overridable with UPSTREAM_* env variables."""
+
+    model_config = SettingsConfigDict(env_prefix="UPSTREAM_")
+
+    max_connections: int = 100
+    max_keepalive_connections: int = 20
+    keepalive_expiry: float = 30.0
+    max_connections_per_host: int = 20
+    connect_timeout: float = 5.0
+    read_timeout: float = 15.0
+    write_timeout: float = 5.0
+    pool_timeout: float = 5.0
+    # Calls beyond max_connections_per_host that may wait for a slot before failing fast
+    max_queued_per_host: int = 100
+    # The breaker opens when at least breaker_failure_rate of the last
+    # breaker_window calls (and no fewer than breaker_min_calls) failed
+    breaker_window: int = 20
+    breaker_min_calls: int = 10
+    breaker_failure_rate: float = 0.5
+    breaker_open_seconds: float = 30.0
+    breaker_half_open_calls: int = 1
+    # Retries after the first attempt, on transport errors and retry_statuses
+    retry_attempts: int = 2
+    retry_backoff_initial: float = 0.1
+    retry_backoff_max: float = 2.0
+    retry_statuses: list[int] = [502, 503, 504]
+    # Fire a second request once hedge_quantile of recent latencies has elapsed
+    hedge_enabled: bool = False
+    hedge_quantile: float = 0.95
+    hedge_min_samples: int = 20
+    # Overall budget for one call, including retries and hedges
+    deadline: float = 10.0
+
+
+class CircuitOpenError(httpx.RequestError):
+    """The upstream host's circuit breaker is open; the call was not attempted."""
+
+
+class BulkheadFullError(httpx.RequestError):
+    """Too many calls are already in flight or waiting for the upstream host."""
+
+
+class DeadlineExceeded(httpx.TimeoutException):
+    """The call's latency budget ran out before the upstream answered."""
+
+
+class LatencyTracker:
+    """Recent latencies of one upstream host."""
+
+    def __init__(self, size: int = 200):
+        self.samples: deque[float] = deque(maxlen=size)
+
+    def record(self, seconds: float):
+        self.samples.append(seconds)
+
+    def quantile(self, q: float) -> Optional[float]:
+        if not self.samples:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[int(q * (len(ordered) - 1))]
+
+
+class CircuitBreaker:
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        window: int,
+        min_calls: int,
+        failure_rate: float,
+        open_seconds: float,
+        half_open_calls: int,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self.clock = clock
+        self.state = self.CLOSED
+        self.outcomes: deque[bool] = deque(maxlen=window)
+        self.opened_at = 0.0
+        self.probes_in_flight = 0
+        # Numbers each stay in a state, so outcomes of calls let through in an
+        # earlier period (e.g. before the breaker opened) are not mistaken for probes
+        self.period = 1
+        self.rejected = 0
+        self.transitions: dict[str, int] = {}
+
+    def _transition(self, state: str):
+        name = f"{self.state}->{state}"
+        self.transitions[name] = self.transitions.get(name, 0) + 1
+        self.state = state
+        self.period += 1
+        self.probes_in_flight = 0
+        if state == self.OPEN:
+            self.opened_at = self.clock()
+        elif state == self.CLOSED:
+            self.outcomes.clear()
+
+    def current_failure_rate(self) -> float:
+        if not self.outcomes:
+            return 0.0
+        return self.outcomes.count(False) / len(self.outcomes)
+
+    def allow(self) -> Optional[int]:
+        """
+        None when the call is refused; otherwise the current period, to be
+        passed back to record() with the call's outcome.
+        """
+        if self.state == self.OPEN:
+            if self.clock() - self.opened_at < self.open_seconds:
+                self.rejected += 1
+                return None
+            self._transition(self.HALF_OPEN)
+        if self.state == self.HALF_OPEN:
+            if self.probes_in_flight >= self.half_open_calls:
+                self.rejected += 1
+                return None
+            self.probes_in_flight += 1
+        return self.period
+
+    def record(self, period: int, success: Optional[bool]):
+        """Records an allowed call's outcome; None means it was abandoned."""
+        if period != self.period:
+            # Let through before the last transition; says nothing about now
+            return
+        if self.state == self.HALF_OPEN:
+            self.probes_in_flight = max(0, self.probes_in_flight - 1)
+            if success is True:
+                self._transition(self.CLOSED)
+            elif success is False:
+                self._transition(self.OPEN)
+            return
+        if success is None or self.state != self.CLOSED:
+            return
+        self.outcomes.append(success)
+        if len(self.outcomes) >= self.min_calls and self.current_failure_rate() >= self.failure_rate:
+            self._transition(self.OPEN)
+
+    def stats(self) -> dict:
+        return {
+            "state": self.state,
+            "failure_rate": round(self.current_failure_rate(), 4),
+            "calls_in_window": len(self.outcomes),
+            "rejected": self.rejected,
+            "transitions": dict(self.transitions),
+        }
+
+
+class Bulkhead:
+    """Caps concurrent calls, letting a bounded number wait and rejecting the rest."""
+
+    def __init__(self, max_concurrent: int, max_queued: int):
+        self.max_queued = max_queued
+        self._slots = asyncio.Semaphore(max_concurrent)
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+
+    async def __aenter__(self):
+        if self._slots.locked() and self.waiting >= self.max_queued:
+            self.rejected += 1
+            raise BulkheadFullError("Too many concurrent upstream calls")
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.active += 1
+
+    async def __aexit__(self, *exc_info):
+        self.active -= 1
+        self._slots.release()
+
+    def stats(self) -> dict:
+        return {"active": self.active, "waiting": self.waiting, "rejected": self.rejected}
+
+
+def request_key(url: str, headers: Optional[dict]) -> tuple:
+    """Identifies GETs that can share one upstream request."""
+    return url, tuple(sorted((headers or {}).items()))
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key into one execution.
+
+    The first caller starts the work in its own task; callers arriving while
+    it runs await that task and share its result or its exception.
+    """
+
+    def __init__(self):
+        self._in_flight: dict[Hashable, asyncio.Task] = {}
+        self.calls = 0
+        self.executions = 0
+        self.coalesced = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        task = self._in_flight.get(key)
+        if task is None:
+            self.executions += 1
+            task = asyncio.ensure_future(fn())
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._finished(key, done))
+        else:
+            self.coalesced += 1
+        # Shield so one cancelled caller does not cancel the shared fetch
+        return await asyncio.shield(task)
+
+    def _finished(self, key: Hashable, task: asyncio.Task):
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "in_flight": len(self._in_flight),
+        }
+
+
+class UpstreamClient:
+    """Owns the pooled client and tracks how much of the pool is in use."""
+
+    def __init__(self, settings: UpstreamSettings):
+        self.settings = settings
+        self._client: Optional[httpx.AsyncClient] = None
+        self._bulkheads: dict[str, Bulkhead] = {}
+        self._breakers: dict[str, CircuitBreaker] = {}
+        self._latencies: dict[str, LatencyTracker] = {}
+        self.single_flight = SingleFlight()
+        self.revalidations = 0
+        self.revalidation_hits = 0
+        self.full_fetches = 0
+        self.retries = 0
+        self.deadlines_exceeded = 0
+        self.hedges_fired = 0
+        self.hedges_won = 0
+        self.streams = 0
+        self.streamed_bytes = 0
+        self.clients_created = 0
+        self.requests_total = 0
+        self.errors_total = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+
+    def _build_client(self) -> httpx.AsyncClient:
+        limits = httpx.Limits(
+            max_connections=self.settings.max_connections,
+            max_keepalive_connections=self.settings.max_keepalive_connections,
+            keepalive_expiry=self.settings.keepalive_expiry,
+        )
+        timeout = httpx.Timeout(
+            connect=self.settings.connect_timeout,
+            read=self.settings.read_timeout,
+            write=self.settings.write_timeout,
+            pool=self.settings.pool_timeout,
+        )
+        self.clients_created += 1
+        return httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Created lazily as well, so the client also works when the app is
+        # driven without its lifespan (e.g. a bare TestClient).
+        if self._client is None or self._client.is_closed:
+            self._client = self._build_client()
+        return self._client
+
+    async def start(self):
+        self.client
+
+    async def close(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+        self._bulkheads.clear()
+
+    def _bulkhead_for(self, host: str) -> Bulkhead:
+        bulkhead = self._bulkheads.get(host)
+        if bulkhead is None:
+            bulkhead = Bulkhead(self.settings.max_connections_per_host, self.settings.max_queued_per_host)
+            self._bulkheads[host] = bulkhead
+        return bulkhead
+
+    def breaker_for(self, host: str) -> CircuitBreaker:
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = CircuitBreaker(
+                window=self.settings.breaker_window,
+                min_calls=self.settings.breaker_min_calls,
+                failure_rate=self.settings.breaker_failure_rate,
+                open_seconds=self.settings.breaker_open_seconds,
+                half_open_calls=self.settings.breaker_half_open_calls,
+            )
+            self._breakers[host] = breaker
+        return breaker
+
+    async def get(self, url: str, headers: Optional[dict] = None, deadline: Optional[float] = None) -> httpx.Response:
+        """
+        GET `url`, sharing one upstream request between concurrent callers.
+
+        Raises DeadlineExceeded when `deadline` seconds (default: the
+        configured deadline) pass without a response, retries included.
+        """
+        budget = self.settings.deadline if deadline is None else deadline
+        return await self.single_flight.do(request_key(url, headers), lambda: self._get_within(url, headers, budget))
+
+    async def _get_within(self, url: str, headers: Optional[dict], deadline: float) -> httpx.Response:
+        try:
+            return await asyncio.wait_for(self._get_with_retries(url, headers), deadline)
+        except asyncio.TimeoutError:
+            self.deadlines_exceeded += 1
+            raise DeadlineExceeded(f"No response from {url} within {deadline}s")
+
+    def retry_delay(self, attempt: int) -> float:
+        # Full jitter: anywhere between zero and the exponential backoff
+        backoff = self.settings.retry_backoff_initial * 2 ** (attempt - 1)
+        return random.uniform(0, min(backoff, self.settings.retry_backoff_max))
+
+    async def _get_with_retries(self, url: str, headers: Optional[dict]) -> httpx.Response:
+        attempt = 0
+        while True:
+            try:
+                response = await self._get_hedged(url, headers)
+            except httpx.TransportError:
+                # Breaker and bulkhead rejections are not TransportErrors, so
+                # they are never retried
+                if attempt >= self.settings.retry_attempts:
+                    raise
+            else:
+                if response.status_code not in self.settings.retry_statuses or attempt >= self.settings.retry_attempts:
+                    return response
+            attempt += 1
+            self.retries += 1
+            await asyncio.sleep(self.retry_delay(attempt))
+
+    def hedge_delay(self, host: str) -> Optional[float]:
+        if not self.settings.hedge_enabled:
+            return None
+        tracker = self._latencies.get(host)
+        if tracker is None or len(tracker.samples) < self.settings.hedge_min_samples:
+            return None
+        return tracker.quantile(self.settings.hedge_quantile)
+
+    async def _get_hedged(self, url: str, headers: Optional[dict]) -> httpx.Response:
+        delay = self.hedge_delay(urlsplit(url).netloc)
+        if delay is None:
+            return await self._get(url, headers)
+
+        primary = asyncio.ensure_future(self._get(url, headers))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if not done:
+                self.hedges_fired += 1
+                pending.add(asyncio.ensure_future(self._get(url, headers)))
+            error = None
+            while True:
+                for task in done:
+                    if task.exception() is None:
+                        if task is not primary:
+                            self.hedges_won += 1
+                        return task.result()
+                    error = task.exception()
+                if not pending:
+                    raise error
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def revalidate(
+        self,
+        url: str,
+        etag: Optional[str] = None,
+        last_modified: Optional[str] = None,
+        deadline: Optional[float] = None,
+    ) -> httpx.Response:
+        """
+        GET `url` conditionally on validators from a previous response.
+
+        A 304 means the cached copy is still current; anything else is a full
+        fetch and is returned for the caller to process as usual.
+        """
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        budget = self.settings.deadline if deadline is None else deadline
+        return await self.single_flight.do(
+            request_key(url, headers), lambda: self._revalidate_within(url, headers or None, budget)
+        )
+
+    async def _revalidate_within(self, url: str, headers: Optional[dict], deadline: float) -> httpx.Response:
+        # Counted here, once per upstream request, rather than once per coalesced caller
+        if headers:
+            self.revalidations += 1
+        response = await self._get_within(url, headers, deadline)
+        if response.status_code == 304:
+            self.revalidation_hits += 1
+        else:
+            self.full_fetches += 1
+        return response
+
+    async def _get(self, url: str, headers: Optional[dict]) -> httpx.Response:
+        host = urlsplit(url).netloc
+        breaker = self.breaker_for(host)
+        period = breaker.allow()
+        if period is None:
+            raise CircuitOpenError(f"Circuit breaker open for {host}")
+        success = None
+        try:
+            async with self._bulkhead_for(host):
+                self.requests_total += 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                started = time.perf_counter()
+                try:
+                    response = await self.client.get(url, headers=headers)
+                except httpx.RequestError:
+                    self.errors_total += 1
+                    success = False
+                    raise
+                finally:
+                    self.in_flight -= 1
+            self._latencies.setdefault(host, LatencyTracker()).record(time.perf_counter() - started)
+            success = response.status_code < 500
+            return response
+        finally:
+            breaker.record(period, success)
+
+    @asynccontextmanager
+    async def stream(
+        self, url: str, headers: Optional[dict] = None, deadline: Optional[float] = None
+    ) -> AsyncIterator[httpx.Response]:
+        """
+        GET `url` without reading the body, for piping it through as it arrives.
+
+        Not retried, hedged or coalesced: the body can only be consumed once.
+        `deadline` bounds the wait for the response headers only.
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breaker_for(host)
+        period = breaker.allow()
+        if period is None:
+            raise CircuitOpenError(f"Circuit breaker open for {host}")
+        budget = self.settings.deadline if deadline is None else deadline
+        success = None
+        try:
+            async with self._bulkhead_for(host):
+                self.requests_total += 1
+                self.streams += 1
+                self.in_flight += 1
+                self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+                try:
+                    started = time.perf_counter()
+                    request = self.client.build_request("GET", url, headers=headers)
+                    try:
+                        response = await asyncio.wait_for(self.client.send(request, stream=True), budget)
+                    except asyncio.TimeoutError:
+                        self.deadlines_exceeded += 1
+                        raise DeadlineExceeded(f"No response from {url} within {budget}s")
+                    self._latencies.setdefault(host, LatencyTracker()).record(time.perf_counter() - started)
+                    success = response.status_code < 500
+                    try:
+                        yield response
+                    finally:
+                        self.streamed_bytes += response.num_bytes_downloaded
+                        await response.aclose()
+                except httpx.RequestError:
+                    self.errors_total += 1
+                    success = False
+                    raise
+                finally:
+                    self.in_flight -= 1
+        finally:
+            breaker.record(period, success)
+
+    def _pool_connections(self) -> list:
+        # httpx does not expose its connection pool publicly; read it from the
+        # transport when available and report nothing otherwise.
+        if self._client is None:
+            return []
+        pool = getattr(self._client._transport, "_pool", None)
+        return list(getattr(pool, "connections", []))
+
+    def stats(self) -> dict:
+        connections = self._pool_connections()
+        idle = sum(1 for connection in connections if connection.is_idle())
+        active = len(connections) - idle
+        return {
+            "clients_created": self.clients_created,
+            "requests_total": self.requests_total,
+            "errors_total": self.errors_total,
+            "in_flight": self.in_flight,
+            "peak_in_flight": self.peak_in_flight,
+            "in_flight_per_host": {host: bulkhead.active for host, bulkhead in self._bulkheads.items()},
+            "bulkheads": {host: bulkhead.stats() for host, bulkhead in self._bulkheads.items()},
+            "breakers": {host: breaker.stats() for host, breaker in self._breakers.items()},
+            "coalescing": self.single_flight.stats(),
+            "revalidation": {
+                "conditional_requests": self.revalidations,
+                "not_modified": self.revalidation_hits,
+                "full_fetches": self.full_fetches,
+            },
+            "retries": {
+                "retries": self.retries,
+                "deadlines_exceeded": self.deadlines_exceeded,
+            },
+            "streaming": {
+                "streams": self.streams,
+                "bytes": self.streamed_bytes,
+            },
+            "hedging": {
+                "enabled": self.settings.hedge_enabled,
+                "fired": self.hedges_fired,
+                "won": self.hedges_won,
+                "delay_ms": {
+                    host: round(delay * 1000, 2)
+                    for host in self._latencies
+                    if (delay := self.hedge_delay(host)) is not None
+                },
+            },
+            "connections": {
+                "open": len(connections),
+                "active": active,
+                "idle": idle,
+                "max": self.settings.max_connections,
+                "max_keepalive": self.settings.max_keepalive_connections,
+                "max_per_host": self.settings.max_connections_per_host,
+                "utilization": round(active / self.settings.max_connections, 4),
+            },
+        }